@@ -6,4 +6,6 @@ from . import (  # noqa: F401
     targets,
     structures,
     interacting_residues,
+    pockets,
+    ifps,
 )
@@ -6,14 +6,18 @@ Load kinase distances matrices.
 - SiteAlign pocket structure
 """
 
+import json
 import logging
+import os
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from sklearn.metrics import pairwise_distances
-from opencadd.databases import klifs
 
-from . import kinases
+from . import kinases, klifs_cache, pockets
+from .ifps import pack_ifps, unpack_ifps, jaccard_distance_matrix
+from .registry import DatasetRegistry
 from src.paths import PATH_RESULTS, PATH_DATA
 
 logger = logging.getLogger(__name__)
@@ -21,6 +25,28 @@ logger = logging.getLogger(__name__)
 PATH_KISSIM = PATH_RESULTS / "dfg_in/fingerprint_distances_to_kinase_matrix.csv"
 PATH_SITEALIGN = PATH_DATA / "external/sitealign/sitealign_kinase_distance_matrix.csv"
 
+# Datasets available via `load` (memoized per load options and dataset file versions);
+# DO NOT USE underscores in dataset name
+_registry = DatasetRegistry()
+_registry.register(
+    "kissim",
+    lambda **options: kissim(**options),
+    lambda options: _matrix_file_paths(options.get("distances_path") or PATH_KISSIM),
+)
+_registry.register(
+    "klifs-pocket-sequence",
+    lambda **options: klifs_pocket_sequence(**options),
+    [kinases.KINMAP_PATH],
+)
+_registry.register(
+    "klifs-pocket-ifp", lambda **options: klifs_pocket_ifp(**options), [kinases.KINMAP_PATH]
+)
+_registry.register(
+    "sitealign-pocket-structure",
+    lambda **options: sitealign_pocket_structure(**options),
+    lambda options: _matrix_file_paths(options.get("distances_path") or PATH_SITEALIGN),
+)
+
 
 def load(
     dataset_name,
@@ -38,34 +64,32 @@ def load(
     kinmap_kinases : bool
         Map kinase names to KinMap kinase names (default: False).
     distances_path : str or pathlib.Path or None
-        Path to dataset file. If None, use default path for respective dataset.
+        Path to dataset file (CSV or binary NPY file, see `save_matrix`); only used for the
+        file-based datasets 'kissim' and 'sitealign-pocket-structure'. If None, use default path
+        for respective dataset.
 
     Returns
     -------
     pandas.DataFrame
         Profiling data for different kinases (rows) and ligands (columns).
-    """
 
-    dataset_names = [
-        "kissim",
-        "klifs-pocket-sequence",
-        "klifs-pocket-ifp",
-        "sitealign-pocket-structure",
-    ]
+    Notes
+    -----
+    CSV matrices are loaded from their binary version if available, i.e. if a NPY file with the
+    same name (written with `save_matrix`) is found next to the CSV file and is not older than
+    the CSV file.
 
-    # DO NOT USE underscores in dataset name
-    if dataset_name == dataset_names[0]:
-        if distances_path is None:
-            distances_path = PATH_KISSIM
-        return kissim(kinmap_kinases, distances_path)
-    elif dataset_name == dataset_names[1]:
-        return klifs_pocket_sequence(kinmap_kinases=kinmap_kinases)
-    elif dataset_name == dataset_names[2]:
-        return klifs_pocket_ifp(kinmap_kinases=kinmap_kinases)
-    elif dataset_name == dataset_names[3]:
-        return sitealign_pocket_structure(kinmap_kinases=kinmap_kinases)
-    else:
-        raise KeyError(f"Unknown dataset name. Use one of these: {', '.join(dataset_names)}.")
+    Datasets are loaded once per process and load options (and reloaded if the dataset files
+    change); the returned DataFrame shares its values with the memoized dataset, so do not
+    modify it in place (e.g. `df.iloc[0, 0] = 0` or `df.fillna(0, inplace=True)`) but work on
+    `df.copy()` instead.
+    """
+
+    options = {"kinmap_kinases": kinmap_kinases}
+    # File-based datasets
+    if distances_path is not None and dataset_name in ["kissim", "sitealign-pocket-structure"]:
+        options["distances_path"] = distances_path
+    return _registry.load(dataset_name, **options)
 
 
 def kissim(
@@ -80,7 +104,8 @@ def kissim(
     kinmap_kinases : bool
         Map kinase names to KinMap kinase names (default: False).
     distances_path : str or pathlib.Path
-        Path to fingerprint distances CSV `kissim` file.
+        Path to fingerprint distances CSV `kissim` file (or its binary version, see
+        `save_matrix`).
 
     Returns
     -------
@@ -88,7 +113,7 @@ def kissim(
         Kinase distance matrix.
     """
 
-    distance_matrix = pd.read_csv(distances_path, index_col=0)
+    distance_matrix = read_matrix(distances_path)
 
     if kinmap_kinases:
         distance_matrix = _kinmap_kinases(distance_matrix)
@@ -96,7 +121,7 @@ def kissim(
     return distance_matrix
 
 
-def klifs_pocket_sequence(kinmap_kinases=False):
+def klifs_pocket_sequence(kinmap_kinases=False, dtype=np.float64):
     """
     Get kinase distance matrix describing the KLIFS pocket sequence identity.
 
@@ -104,6 +129,9 @@ def klifs_pocket_sequence(kinmap_kinases=False):
     ----------
     kinmap_kinases : bool
         Map kinase names to KinMap kinase names (default: False).
+    dtype : numpy.dtype
+        Data type of the distance values; use `numpy.float32` to halve the memory footprint
+        (default: `numpy.float64`).
 
     Returns
     -------
@@ -112,7 +140,7 @@ def klifs_pocket_sequence(kinmap_kinases=False):
     """
 
     logger.info("Set up KLIFS session...")
-    klifs_session = klifs.setup_remote()
+    klifs_session = klifs_cache.setup_remote()
     logger.info("Fetch kinases...")
     kinase_klifs_ids = klifs_session.kinases.all_kinases(species="Human")[
         "kinase.klifs_id"
@@ -123,14 +151,11 @@ def klifs_pocket_sequence(kinmap_kinases=False):
     logger.info(f"Number of kinases with full pocket sequence: {len(kinases)}")
 
     logger.info("Calculate kinase matrix...")
-    seq_matrix = kinases["kinase.pocket"].apply(list)
-    X = np.array(seq_matrix.to_list())
-    # Expand: Identical position?
-    identity = X[:, None, :] == X[None, :, :]
-    # Reduce
-    similarity_matrix = identity.sum(axis=-1) / X.shape[1]
-    # Similarity > distances
-    distance_matrix = 1 - similarity_matrix
+    codes, _ = pockets.encode_pockets(kinases["kinase.pocket"])
+    # Number of identical positions (in place: similarity > distances)
+    distance_matrix = pockets.pocket_identity_matrix(codes, dtype=dtype)
+    distance_matrix /= -codes.shape[1]
+    distance_matrix += 1
     kinase_names = kinases["kinase.klifs_name"].to_list()
     distance_matrix = pd.DataFrame(distance_matrix, index=kinase_names, columns=kinase_names)
 
@@ -152,7 +177,8 @@ def klifs_pocket_ifp(structure_klifs_ids=None, dfg="in", metric="jaccard", kinma
     dfg : str
         DFG conformation: in (default) or out.
     metric : str
-        Distance metrics as allowed in sklearn.metrics.pairwise_distances.
+        Distance metrics as allowed in sklearn.metrics.pairwise_distances; "jaccard" (default)
+        and "tanimoto" use a faster bit-packed implementation.
     kinmap_kinases : bool
         Map kinase names to KinMap kinase names (default: False).
 
@@ -163,7 +189,7 @@ def klifs_pocket_ifp(structure_klifs_ids=None, dfg="in", metric="jaccard", kinma
     """
 
     logger.info("Set up KLIFS session...")
-    klifs_session = klifs.setup_remote()
+    klifs_session = klifs_cache.setup_remote()
     logger.info("Fetch IFPs...")
     if structure_klifs_ids is None:
         ifps = klifs_session.interactions.all_interactions()
@@ -187,18 +213,16 @@ def klifs_pocket_ifp(structure_klifs_ids=None, dfg="in", metric="jaccard", kinma
     ifps = ifps.set_index(["structure.klifs_id", "kinase.klifs_name"])
 
     logger.info("Calculate structure distance matrix...")
-    # Generate list of lists
-    ifps_list_of_lists = (
-        ifps["interaction.fingerprint"]
-        .apply(list)
-        .apply(lambda x: [True if i == "1" else False for i in x])
-        .to_list()
-    )
-    # Convert to array
-    ifps_array = np.array(ifps_list_of_lists)
+    # Pack IFP bit strings into 64-bit words
+    ifp_strings = ifps["interaction.fingerprint"]
+    packed_ifps = pack_ifps(ifp_strings)
 
     # Calculate pairwise distances
-    structure_distance_matrix = pairwise_distances(ifps_array, metric=metric)
+    if metric in ["jaccard", "tanimoto"]:
+        structure_distance_matrix = jaccard_distance_matrix(packed_ifps)
+    else:
+        ifps_array = unpack_ifps(packed_ifps, len(ifp_strings.iloc[0]))
+        structure_distance_matrix = pairwise_distances(ifps_array, metric=metric)
     # Create DataFrame with structure KLIFS IDs as index/columns
     structure_klifs_ids = ifps.index.get_level_values(0)
     structure_distance_matrix = pd.DataFrame(
@@ -207,15 +231,10 @@ def klifs_pocket_ifp(structure_klifs_ids=None, dfg="in", metric="jaccard", kinma
     logger.info(f"Structure matrix: {structure_distance_matrix.shape}")
 
     logger.info("Calculate kinase distance matrix...")
-    # Copy distance matrix to kinase matrix
-    kinase_distance_matrix = structure_distance_matrix
-    # Replace structure KLIFS IDs with the structures' kinase names
-    kinase_names = ifps.index.get_level_values(1)
-    kinase_distance_matrix.index = kinase_names
-    kinase_distance_matrix.columns = kinase_names
     # Select the minimum structure pair distance for each kinase pair
-    kinase_distance_matrix = (
-        kinase_distance_matrix.stack().groupby(level=[0, 1]).min().unstack(level=1)
+    kinase_names = ifps.index.get_level_values(1)
+    kinase_distance_matrix = structure_to_kinase_matrix(
+        structure_distance_matrix.values, kinase_names, aggregation="min"
     )
     logger.info(f"Kinase matrix: {kinase_distance_matrix.shape}")
 
@@ -225,7 +244,112 @@ def klifs_pocket_ifp(structure_klifs_ids=None, dfg="in", metric="jaccard", kinma
     return kinase_distance_matrix
 
 
-def sitealign_pocket_structure(kinmap_kinases=False):
+def structure_to_kinase_matrix(
+    structure_distance_matrix, kinase_names, aggregation="min", percentile=50, block_size=1024
+):
+    """
+    Aggregate a structure distance matrix to a kinase distance matrix by reducing all structure
+    pair distances per kinase pair.
+
+    Structures are grouped by integer kinase codes; "min", "max", and "mean" are calculated
+    with `reduceat` reductions (first over rows in column blocks, then over columns), so that
+    no long-format copy of the structure matrix is needed. "percentile" sorts the distances of
+    one kinase's structures to all structures at a time (one sort per kinase). The input matrix
+    is read block by block in its own data type (e.g. a memory-mapped float32 matrix, see
+    `read_matrix`); only the blocks and accumulators are float64. Missing values are ignored.
+
+    Parameters
+    ----------
+    structure_distance_matrix : numpy.ndarray or pandas.DataFrame
+        Structure distance matrix (S x S).
+    kinase_names : list of str or pandas.Index
+        Kinase name for each structure (S).
+    aggregation : str
+        Aggregation of structure pair distances per kinase pair: "min" (default), "max",
+        "mean", or "percentile".
+    percentile : float
+        Percentile (0-100) used if `aggregation="percentile"`, e.g. 50 for the median.
+    block_size : int
+        Number of columns processed per block.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Kinase distance matrix (K x K) with kinase names sorted alphabetically.
+    """
+
+    if isinstance(structure_distance_matrix, pd.DataFrame):
+        structure_distance_matrix = structure_distance_matrix.to_numpy(copy=False)
+    structure_distance_matrix = np.asanyarray(structure_distance_matrix)
+    kinase_names_unique, kinase_codes = np.unique(np.asarray(kinase_names), return_inverse=True)
+    kinase_codes = kinase_codes.reshape(-1)
+    # Sort structures by kinase; each kinase group is a contiguous slice starting at `starts`
+    order = np.argsort(kinase_codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(kinase_codes[order]) != 0])
+    ends = np.r_[starts[1:], len(order)]
+    n_structures, n_kinases = len(order), len(starts)
+
+    if aggregation in ["min", "max"]:
+        ufunc = np.fmin if aggregation == "min" else np.fmax
+        # Reduce rows per kinase (column blocks keep the sorted copy small), then columns
+        row_reduced = np.empty((n_kinases, n_structures))
+        for start in range(0, n_structures, block_size):
+            end = min(start + block_size, n_structures)
+            block = structure_distance_matrix[order, start:end].astype(np.float64)
+            row_reduced[:, start:end] = ufunc.reduceat(block, starts, axis=0)
+        kinase_distance_matrix = ufunc.reduceat(row_reduced[:, order], starts, axis=1)
+
+    elif aggregation == "mean":
+        # Reduce sums and counts of non-missing values per kinase, first rows, then columns
+        row_sums = np.empty((n_kinases, n_structures))
+        row_counts = np.empty((n_kinases, n_structures))
+        for start in range(0, n_structures, block_size):
+            end = min(start + block_size, n_structures)
+            block = structure_distance_matrix[order, start:end].astype(np.float64)
+            is_value = ~np.isnan(block)
+            row_sums[:, start:end] = np.add.reduceat(np.where(is_value, block, 0), starts)
+            row_counts[:, start:end] = np.add.reduceat(is_value, starts, dtype=np.int64)
+        sums = np.add.reduceat(row_sums[:, order], starts, axis=1)
+        counts = np.add.reduceat(row_counts[:, order], starts, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            kinase_distance_matrix = np.where(counts > 0, sums / counts, np.nan)
+
+    elif aggregation == "percentile":
+        kinase_distance_matrix = np.empty((n_kinases, n_kinases))
+        group_sizes = ends - starts
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            rows = structure_distance_matrix[order[slice(start, end)]]
+            # Values per kinase j are contiguous segments (structures of j x structures of i)
+            values = rows[:, order].astype(np.float64).T.ravel()
+            segment_starts = starts * (end - start)
+            segments = np.repeat(np.arange(n_kinases), group_sizes * (end - start))
+            # Sort values within segments (missing values last)
+            values = values[np.lexsort((values, segments))]
+            n_values = np.add.reduceat(~np.isnan(values), segment_starts)
+            # Linear interpolation between closest ranks (as `numpy.percentile`)
+            positions = np.maximum(n_values - 1, 0) * (percentile / 100)
+            lower = np.floor(positions).astype(np.int64)
+            upper = np.minimum(lower + 1, np.maximum(n_values - 1, 0))
+            lower_values = values[segment_starts + lower]
+            upper_values = values[segment_starts + upper]
+            kinase_distance_matrix[i] = np.where(
+                n_values > 0,
+                lower_values + (upper_values - lower_values) * (positions - lower),
+                np.nan,
+            )
+
+    else:
+        raise ValueError(
+            f"Unknown aggregation: {aggregation}. Use 'min', 'max', 'mean', or 'percentile'."
+        )
+
+    kinase_names_unique = pd.Index(kinase_names_unique, name=getattr(kinase_names, "name", None))
+    return pd.DataFrame(
+        kinase_distance_matrix, index=kinase_names_unique, columns=kinase_names_unique
+    )
+
+
+def sitealign_pocket_structure(kinmap_kinases=False, distances_path=PATH_SITEALIGN):
     """
     Get kinase distance matrix describing the KLIFS pocket IFP similarity.
 
@@ -233,6 +357,8 @@ def sitealign_pocket_structure(kinmap_kinases=False):
     ----------
     kinmap_kinases : bool
         Map kinase names to KinMap kinase names (default: False).
+    distances_path : str or pathlib.Path
+        Path to SiteAlign kinase distances CSV file (or its binary version, see `save_matrix`).
 
     Returns
     -------
@@ -240,7 +366,7 @@ def sitealign_pocket_structure(kinmap_kinases=False):
         Kinase distance matrix.
     """
 
-    kinase_distance_matrix = pd.read_csv(PATH_SITEALIGN, index_col=0)
+    kinase_distance_matrix = read_matrix(distances_path)
 
     if kinmap_kinases:
         kinase_distance_matrix = _kinmap_kinases(kinase_distance_matrix)
@@ -248,6 +374,100 @@ def sitealign_pocket_structure(kinmap_kinases=False):
     return kinase_distance_matrix
 
 
+def save_matrix(distance_matrix, matrix_path, dtype=np.float32):
+    """
+    Save a kinase distance matrix in a binary format that can be memory-mapped: The full square
+    matrix is saved as NPY array and the kinase names are saved as label table in a JSON file
+    next to it (`<name>.labels.json`).
+
+    Parameters
+    ----------
+    distance_matrix : pandas.DataFrame
+        Symmetric kinase distance matrix (same kinases as index and columns).
+    matrix_path : str or pathlib.Path
+        Path to NPY file.
+    dtype : numpy.dtype
+        Data type of the saved distances (default: `numpy.float32`).
+    """
+
+    matrix_path = Path(matrix_path)
+    if matrix_path.suffix != ".npy":
+        raise ValueError(f"Binary matrix path must end with .npy: {matrix_path}")
+    if distance_matrix.index.to_list() != distance_matrix.columns.to_list():
+        raise ValueError("Distance matrix must have the same kinases as index and columns.")
+    values = distance_matrix.to_numpy(dtype=np.float64)
+    if not np.allclose(values, values.T, equal_nan=True):
+        raise ValueError("Distance matrix must be symmetric.")
+
+    labels = {
+        "dtype": np.dtype(dtype).name,
+        "n_kinases": len(values),
+        "kinases": distance_matrix.index.to_list(),
+    }
+    # Write label table last: a matrix is only read if its label table exists
+    labels_path = _labels_path(matrix_path)
+    if labels_path.exists():
+        labels_path.unlink()
+    np.save(matrix_path, values.astype(dtype))
+    with open(labels_path, "w") as f:
+        json.dump(labels, f)
+
+
+def read_matrix(matrix_path, mmap=True):
+    """
+    Read a kinase distance matrix from a CSV file or from its binary version (see
+    `save_matrix`). For CSV files, the binary version is used if a NPY file with the same name
+    exists next to the CSV file and is not older than the CSV file.
+
+    Parameters
+    ----------
+    matrix_path : str or pathlib.Path
+        Path to CSV or NPY file.
+    mmap : bool
+        Memory-map the binary matrix (default: True). The returned DataFrame wraps the read-only
+        memory map without copying, so processes reading the same file share its physical
+        pages; operations that subset or copy the DataFrame (e.g. `kinmap_kinases=True`)
+        create private in-memory copies. Do not modify the values in place (read-only).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Kinase distance matrix.
+    """
+
+    matrix_path = Path(matrix_path)
+    if matrix_path.suffix != ".npy":
+        binary_path = matrix_path.with_suffix(".npy")
+        binary_exists = binary_path.exists() and _labels_path(binary_path).exists()
+        if binary_exists and os.path.getmtime(binary_path) >= os.path.getmtime(matrix_path):
+            matrix_path = binary_path
+        else:
+            return pd.read_csv(matrix_path, index_col=0)
+
+    with open(_labels_path(matrix_path), "r") as f:
+        labels = json.load(f)
+    values = np.load(matrix_path, mmap_mode="r" if mmap else None)
+    return pd.DataFrame(values, index=labels["kinases"], columns=labels["kinases"], copy=False)
+
+
+def _matrix_file_paths(matrix_path):
+    """
+    Get all files a file-based dataset is read from: Matrix file, its binary version and label
+    table (see `read_matrix`), and the KinMap dataset (used for `kinmap_kinases=True`).
+    """
+
+    binary_path = Path(matrix_path).with_suffix(".npy")
+    return [matrix_path, binary_path, _labels_path(binary_path), kinases.KINMAP_PATH]
+
+
+def _labels_path(matrix_path):
+    """
+    Get path to label table for a binary matrix file.
+    """
+
+    return Path(matrix_path).with_suffix(".labels.json")
+
+
 def _kinmap_kinases(kinase_df):
 
     kinase_names_new = kinases._kinmap_kinase_names(kinase_df.columns)
@@ -0,0 +1,134 @@
+"""
+Encode KLIFS interaction fingerprints (IFPs) as packed bits and compare them.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Number of set bits for all byte values 0-255
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def pack_ifps(ifp_strings):
+    """
+    Pack IFP bit strings (e.g. 595 characters "0"/"1" for the KLIFS IFP) into 64-bit words.
+
+    Parameters
+    ----------
+    ifp_strings : list of str or pandas.Series
+        IFP bit strings; all strings must have the same length.
+
+    Returns
+    -------
+    numpy.ndarray
+        Packed IFPs (uint64) for all IFPs (rows) with ceil(n_bits / 64) words (columns); unused
+        trailing bits are 0.
+    """
+
+    ifp_strings = list(ifp_strings)
+    if len(set(len(ifp_string) for ifp_string in ifp_strings)) > 1:
+        raise ValueError("IFP strings must have the same length.")
+
+    n_ifps = len(ifp_strings)
+    bits = np.frombuffer("".join(ifp_strings).encode("ascii"), dtype=np.uint8) == ord("1")
+    bits = bits.reshape(n_ifps, -1)
+    packed = np.packbits(bits, axis=1)
+    # Pad bytes to full 64-bit words
+    n_bytes = -(-packed.shape[1] // 8) * 8
+    packed_padded = np.zeros((n_ifps, n_bytes), dtype=np.uint8)
+    packed_padded[:, : packed.shape[1]] = packed
+
+    return packed_padded.view(np.uint64)
+
+
+def unpack_ifps(packed_ifps, n_bits):
+    """
+    Unpack packed IFPs to a boolean array.
+
+    Parameters
+    ----------
+    packed_ifps : numpy.ndarray
+        Packed IFPs from `pack_ifps`.
+    n_bits : int
+        Number of bits per IFP.
+
+    Returns
+    -------
+    numpy.ndarray
+        IFP bits (bool) for all IFPs (rows) and IFP bits (columns).
+    """
+
+    bits = np.unpackbits(packed_ifps.view(np.uint8), axis=1)[:, :n_bits]
+    return bits.astype(bool)
+
+
+def popcount(words):
+    """
+    Count the set bits per 64-bit word.
+
+    Parameters
+    ----------
+    words : numpy.ndarray
+        Array of uint64 words.
+
+    Returns
+    -------
+    numpy.ndarray
+        Number of set bits (uint8) per word (same shape as input).
+    """
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    words = np.ascontiguousarray(words)
+    return (
+        _POPCOUNT_TABLE[words.view(np.uint8)]
+        .reshape(words.shape + (8,))
+        .sum(axis=-1, dtype=np.uint8)
+    )
+
+
+def jaccard_distance_matrix(packed_ifps, block_size=512, dtype=np.float64):
+    """
+    Calculate the Jaccard (Tanimoto) distances between all pairs of packed IFPs.
+
+    The number of shared bits is counted word by word with popcounts in blocks of `block_size`
+    rows, so that the memory needed on top of the N x N output is bounded by a few
+    `block_size` x N arrays. Pairs of IFPs without any set bits have a distance of 0 (same as
+    `sklearn.metrics.pairwise_distances(..., metric="jaccard")`).
+
+    Parameters
+    ----------
+    packed_ifps : numpy.ndarray
+        Packed IFPs from `pack_ifps`.
+    block_size : int
+        Number of IFPs (rows) processed per block.
+    dtype : numpy.dtype
+        Output data type (default: `numpy.float64`).
+
+    Returns
+    -------
+    numpy.ndarray
+        Jaccard distances for all IFP pairs (N x N).
+    """
+
+    n_ifps, n_words = packed_ifps.shape
+    n_bits = popcount(packed_ifps).sum(axis=1, dtype=np.int64)
+
+    distance_matrix = np.empty((n_ifps, n_ifps), dtype=dtype)
+    for start in range(0, n_ifps, block_size):
+        end = min(start + block_size, n_ifps)
+        n_shared_bits = np.zeros((end - start, n_ifps), dtype=np.int64)
+        for word in range(n_words):
+            n_shared_bits += popcount(
+                packed_ifps[start:end, word, None] & packed_ifps[None, :, word]
+            )
+        n_union_bits = n_bits[start:end, None] + n_bits[None, :] - n_shared_bits
+        with np.errstate(invalid="ignore", divide="ignore"):
+            distances = 1 - n_shared_bits / n_union_bits
+        distances[n_union_bits == 0] = 0
+        distance_matrix[start:end] = distances
+
+    return distance_matrix
@@ -4,7 +4,8 @@ Load interacting residues in KLIFS pocket based on the KLIFS IFPs.
 
 import numpy as np
 import pandas as pd
-from opencadd.databases.klifs import setup_remote
+
+from .klifs_cache import setup_remote
 
 
 def residues_interacting_with_ligand(ligand_expo_id):
@@ -2,25 +2,39 @@
 Load kinase datasets.
 """
 
+import hashlib
 import logging
+from pathlib import Path
+from urllib.request import urlretrieve
 
 import pandas as pd
 
+from .name_index import NameIndex, persisted_index
+
 logger = logging.getLogger(__name__)
 
 KINMAP_URL = (
     "https://raw.githubusercontent.com/openkinome/kinodata/master/data/KinHubKinaseList.csv"
 )
+DATA_PATH = Path(__file__).parent / "../../data/external/profiling"
+KINMAP_PATH = DATA_PATH / "KinMap/KinHubKinaseList.csv"
+
+# Name indices per KinMap file checksum (built or loaded once per process)
+_kinmap_indices = {}
 
 
-def kinmap(kinmap_url=KINMAP_URL):
+def kinmap(kinmap_url=KINMAP_URL, kinmap_path=None):
     """
-    Load KinMap kinase dataset.
+    Load KinMap kinase dataset from a local copy; if the local copy does not exist, download the
+    dataset to this path first.
 
     Parameters
     ----------
     kinmap_url : str
         KinMap URL for kinase dataset.
+    kinmap_path : str or pathlib.Path or None
+        Path to local copy of KinMap kinase dataset. If None, use the local copy of the given URL
+        (see `kinmap_local_path`).
 
     Returns
     -------
@@ -30,13 +44,79 @@ def kinmap(kinmap_url=KINMAP_URL):
         "SubFamily") and "UniProtID".
     """
 
-    kinmap_df = pd.read_csv(kinmap_url)
+    kinmap_path = Path(kinmap_path or kinmap_local_path(kinmap_url))
+    if not kinmap_path.exists():
+        logger.info(f"Download KinMap kinase dataset to {kinmap_path}...")
+        kinmap_path.parent.mkdir(parents=True, exist_ok=True)
+        urlretrieve(kinmap_url, kinmap_path)
+
+    kinmap_df = pd.read_csv(kinmap_path)
     return kinmap_df
 
 
+def kinmap_local_path(kinmap_url=KINMAP_URL):
+    """
+    Get path to the local copy of a KinMap kinase dataset URL: `KINMAP_PATH` for the default
+    URL, else a file named by the URL checksum next to it (so that different URLs never share
+    a local copy).
+
+    Parameters
+    ----------
+    kinmap_url : str
+        KinMap URL for kinase dataset.
+
+    Returns
+    -------
+    pathlib.Path
+        Path to local copy.
+    """
+
+    if kinmap_url == KINMAP_URL:
+        return KINMAP_PATH
+    checksum = hashlib.sha256(kinmap_url.encode()).hexdigest()[:12]
+    return KINMAP_PATH.with_name(f"{KINMAP_PATH.stem}_{checksum}{KINMAP_PATH.suffix}")
+
+
+def kinmap_index(kinmap_path=KINMAP_PATH):
+    """
+    Get name index that maps kinase names (KinMap, Manning, and HGNC names) to KinMap kinase
+    names. The index is built once per KinMap dataset version and persisted on disk.
+
+    Parameters
+    ----------
+    kinmap_path : str or pathlib.Path
+        Path to local copy of KinMap kinase dataset.
+
+    Returns
+    -------
+    src.data.name_index.NameIndex
+        KinMap name index; use `kinmap_index().resolve(kinase_names)` to map kinase names.
+    """
+
+    kinmap_path = Path(kinmap_path)
+    if not kinmap_path.exists():
+        kinmap(kinmap_path=kinmap_path)
+    checksum = hashlib.sha256(kinmap_path.read_bytes()).hexdigest()
+
+    if checksum not in _kinmap_indices:
+
+        def _build_index():
+            kinmap_df = kinmap(kinmap_path=kinmap_path)
+            return NameIndex.from_entries(
+                kinmap_df["xName"],
+                zip(kinmap_df["Manning\xa0Name"], kinmap_df["HGNC\xa0Name"]),
+                source="KinMap",
+                entity="kinase",
+            )
+
+        _kinmap_indices[checksum] = persisted_index("kinmap", checksum, _build_index)
+
+    return _kinmap_indices[checksum]
+
+
 def _kinmap_kinase_names(kinase_names):
     """
-    Cast given ligand names to the PKIDB ligand IDs.
+    Cast given kinase names to the KinMap kinase names.
 
     Parameters
     ----------
@@ -46,13 +126,14 @@ def _kinmap_kinase_names(kinase_names):
     Returns
     -------
     list of str
-        List of KinMap kinase names.
+        List of KinMap kinase names. If input kinase name unknown or ambiguous return
+        "unknown (why?)".
     """
 
-    kinmap_df = kinmap()
-    kinmap_kinase_names = [
-        _kinmap_kinase_name(kinase_name, kinmap_df) for kinase_name in kinase_names
-    ]
+    # KinMap uses underscores instead of dashes
+    kinmap_kinase_names = kinmap_index().resolve(
+        [kinase_name.replace("-", "_") for kinase_name in kinase_names]
+    )
 
     change_log = pd.DataFrame({"kinase.input": kinase_names, "kinase.kinmap": kinmap_kinase_names})
     change_log = change_log[change_log["kinase.input"] != change_log["kinase.kinmap"]]
@@ -63,35 +144,3 @@ def _kinmap_kinase_names(kinase_names):
         )
 
     return kinmap_kinase_names
-
-
-def _kinmap_kinase_name(kinase_name, kinmap_df):
-    """
-    Cast a given kinase name to the KinMap kinase name.
-
-    Parameters
-    ----------
-    kinase_name : str
-        Kinase name.
-    kinmap_df : pandas.DataFrame
-        Kinase data (columns) for all KinMap kinases (rows) from `kinases.kinmap()`.
-
-    Returns
-    -------
-    str
-        KinMap kinase name. If input kinase name unknown or ambiguous return "unknown (why?)".
-    """
-
-    kinase_name = kinase_name.replace("-", "_")
-    if kinmap_df["xName"].isin([kinase_name]).any():
-        return kinase_name
-    else:
-        manning_condition = kinmap_df["Manning\xa0Name"] == kinase_name
-        hgnc_condition = kinmap_df["HGNC\xa0Name"] == kinase_name
-        kinase_name_kinmap = kinmap_df[manning_condition | hgnc_condition]
-        if len(kinase_name_kinmap) == 0:
-            return "unknown (not in KinMap)"
-        elif len(kinase_name_kinmap) == 1:
-            return kinase_name_kinmap.squeeze()["xName"]
-        else:
-            return "unknown (ambiguous kinase name)"
@@ -0,0 +1,219 @@
+"""
+Cache KLIFS remote session queries on disk.
+
+Query results are stored per KLIFS release in files named by the hash of the query (provider,
+method, and arguments), so that repeated runs do not download the same data again and cached
+queries remain available on nodes without internet access (offline mode).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+from opencadd.databases import klifs
+
+from src.paths import PATH_DATA
+from src.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = PATH_DATA / "interim/klifs_cache"
+# Time to live for cached queries in seconds (30 days)
+CACHE_TTL = 30 * 24 * 60 * 60
+# Environment variables to set the KLIFS release label and to switch on the offline mode
+KLIFS_RELEASE_VARIABLE = "KLIFS_RELEASE"
+OFFLINE_VARIABLE = "KLIFS_OFFLINE"
+
+
+def setup_remote(release=None, offline=None, ttl=CACHE_TTL, max_size=None, cache_path=CACHE_PATH):
+    """
+    Set up a remote KLIFS session whose query results are cached on disk.
+
+    Parameters
+    ----------
+    release : str or None
+        KLIFS release label used to separate cached queries from different KLIFS releases.
+        If None, use the `KLIFS_RELEASE` environment variable (default: "current").
+    offline : bool or None
+        Never connect to KLIFS; only cached queries can be used. If None, offline mode is
+        switched on if the `KLIFS_OFFLINE` environment variable is set to "1".
+    ttl : int or float or None
+        Time to live for cached queries in seconds (default: 30 days). Expired queries are
+        fetched again (unless in offline mode). If None, cached queries never expire.
+    max_size : int or None
+        Maximum cache size in bytes per release; the least recently used queries are evicted
+        once exceeded. If None, the cache size is not limited.
+    cache_path : str or pathlib.Path
+        Path to cache folder.
+
+    Returns
+    -------
+    src.data.klifs_cache.CachedSession
+        Cached KLIFS session with the same query API as a remote KLIFS session, e.g.
+        `session.kinases.all_kinases(species="Human")`.
+    """
+
+    if release is None:
+        release = os.environ.get(KLIFS_RELEASE_VARIABLE, "current")
+    if offline is None:
+        offline = os.environ.get(OFFLINE_VARIABLE, "0") == "1"
+    return CachedSession(release, offline, ttl, max_size, cache_path)
+
+
+class CachedSession:
+    """
+    Remote KLIFS session wrapper that caches query results on disk.
+
+    Attributes
+    ----------
+    release : str
+        KLIFS release label.
+    offline : bool
+        Offline mode; queries not in the cache raise a FileNotFoundError.
+    ttl : int or float or None
+        Time to live for cached queries in seconds.
+    max_size : int or None
+        Maximum cache size in bytes.
+    cache_path : pathlib.Path
+        Path to the cache folder of this KLIFS release.
+    """
+
+    def __init__(self, release, offline, ttl, max_size, cache_path):
+
+        self.release = release
+        self.offline = offline
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_path = Path(cache_path) / release
+        self._session = None
+
+    def __getattr__(self, name):
+        # Providers such as `kinases`, `interactions`, `structures`, ...
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _CachedProvider(self, name)
+
+    @property
+    def remote(self):
+        """
+        Remote KLIFS session (set up on first use).
+        """
+
+        if self.offline:
+            raise FileNotFoundError("Remote KLIFS session is not available in offline mode.")
+        if self._session is None:
+            logger.info("Set up remote KLIFS session...")
+            self._session = klifs.setup_remote()
+        return self._session
+
+    def query(self, provider, method, *args, **kwargs):
+        """
+        Get query result from the cache or, if not cached or expired, from KLIFS.
+
+        Parameters
+        ----------
+        provider : str
+            KLIFS session provider, e.g. "kinases".
+        method : str
+            Provider method, e.g. "all_kinases".
+        *args, **kwargs
+            Arguments passed to the provider method.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Query result.
+        """
+
+        query = {"provider": provider, "method": method, "args": args, "kwargs": kwargs}
+        query_string = json.dumps(query, sort_keys=True, default=_to_json)
+        key = hashlib.sha256(query_string.encode()).hexdigest()
+        path = self.cache_path / f"{key}.pkl"
+
+        if path.exists():
+            expired = self.ttl is not None and time.time() - path.stat().st_mtime > self.ttl
+            if not expired or self.offline:
+                if expired:
+                    logger.warning(f"Use expired cached query (offline mode): {query_string}")
+                # Update access time (used for eviction) but keep modification time (used for TTL)
+                os.utime(path, (time.time(), path.stat().st_mtime))
+                return pd.read_pickle(path)["result"]
+        if self.offline:
+            raise FileNotFoundError(f"Query not cached (offline mode): {query_string}")
+
+        logger.info(f"Query KLIFS: {query_string}")
+        result = getattr(getattr(self.remote, provider), method)(*args, **kwargs)
+
+        atomic_write(path, lambda path: pd.to_pickle({"query": query, "result": result}, path))
+        self.evict()
+
+        return result
+
+    def evict(self):
+        """
+        Remove expired queries and, if the cache exceeds `max_size`, the least recently used
+        queries from the cache.
+        """
+
+        if not self.cache_path.exists():
+            return
+        paths = [(path, path.stat()) for path in self.cache_path.glob("*.pkl")]
+
+        if self.ttl is not None:
+            now = time.time()
+            for path, stat in paths:
+                if now - stat.st_mtime > self.ttl:
+                    path.unlink()
+            paths = [(path, stat) for path, stat in paths if path.exists()]
+
+        if self.max_size is not None:
+            size = sum(stat.st_size for _, stat in paths)
+            # Least recently used first
+            for path, stat in sorted(paths, key=lambda x: x[1].st_atime):
+                if size <= self.max_size:
+                    break
+                path.unlink()
+                size -= stat.st_size
+
+    def clear(self):
+        """
+        Remove all cached queries for this KLIFS release.
+        """
+
+        for path in self.cache_path.glob("*.pkl"):
+            path.unlink()
+
+
+class _CachedProvider:
+    """
+    Cached counterpart of a KLIFS session provider, e.g. `session.kinases`.
+    """
+
+    def __init__(self, session, provider):
+
+        self._session = session
+        self._provider = provider
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def _query(*args, **kwargs):
+            return self._session.query(self._provider, method, *args, **kwargs)
+
+        return _query
+
+
+def _to_json(obj):
+    """
+    Serialize query arguments that are not JSON serializable, e.g. NumPy arrays or pandas Series
+    (their string representations may be truncated and hence not unique).
+    """
+
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return str(obj)
@@ -0,0 +1,225 @@
+"""
+Look up KLIFS curation flags for structures.
+
+Flags are requested from the KLIFS REST API in chunks of structure KLIFS IDs (concurrently) and
+stored per KLIFS release in a local JSON file, so that only structures that have not been
+looked up before are requested.
+"""
+
+import json
+import logging
+import os
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .klifs_cache import KLIFS_RELEASE_VARIABLE, OFFLINE_VARIABLE
+from src.paths import PATH_DATA
+from src.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+FLAGS_PATH = PATH_DATA / "interim/klifs_flags"
+KLIFS_API_URL = "https://klifs.net/api_v2"
+# Environment variable to set the KLIFS API URL, e.g. to a local server
+KLIFS_API_URL_VARIABLE = "KLIFS_API_URL"
+
+
+class FlagService:
+    """
+    Look up KLIFS curation flags for structures with a local cache per KLIFS release.
+
+    Attributes
+    ----------
+    release : str
+        KLIFS release label used to separate cached flags from different KLIFS releases.
+    api_url : str
+        KLIFS REST API URL (without trailing slash).
+    offline : bool
+        Never connect to KLIFS; structures without cached flags raise a FileNotFoundError.
+    chunk_size : int
+        Number of structure KLIFS IDs per request.
+    max_workers : int
+        Maximum number of concurrent requests.
+    timeout : int or float
+        Request timeout in seconds.
+    retries : int
+        Number of retries per request.
+    cache_path : pathlib.Path
+        Path to the cache file of this KLIFS release.
+    """
+
+    def __init__(
+        self,
+        release=None,
+        api_url=None,
+        offline=None,
+        chunk_size=500,
+        max_workers=4,
+        timeout=60,
+        retries=2,
+        cache_path=FLAGS_PATH,
+    ):
+        """
+        Initialize FlagService.
+
+        Parameters
+        ----------
+        release : str or None
+            KLIFS release label. If None, use the `KLIFS_RELEASE` environment variable (default:
+            "current").
+        api_url : str or None
+            KLIFS REST API URL. If None, use the `KLIFS_API_URL` environment variable (default:
+            https://klifs.net/api_v2).
+        offline : bool or None
+            Offline mode. If None, offline mode is switched on if the `KLIFS_OFFLINE` environment
+            variable is set to "1".
+        chunk_size, max_workers, timeout, retries
+            See class attributes.
+        cache_path : str or pathlib.Path
+            Path to cache folder.
+        """
+
+        if release is None:
+            release = os.environ.get(KLIFS_RELEASE_VARIABLE, "current")
+        if api_url is None:
+            api_url = os.environ.get(KLIFS_API_URL_VARIABLE, KLIFS_API_URL)
+        if offline is None:
+            offline = os.environ.get(OFFLINE_VARIABLE, "0") == "1"
+
+        self.release = release
+        self.api_url = api_url.rstrip("/")
+        self.offline = offline
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.cache_path = Path(cache_path) / f"{release}.json"
+        self._flags = None
+
+    @property
+    def cached_flags(self):
+        """
+        Cached curation flags.
+
+        Returns
+        -------
+        dict of int: (bool or None)
+            Curation flag (values; None if structure is unknown to KLIFS) for all cached
+            structure KLIFS IDs (keys).
+        """
+
+        if self._flags is None:
+            self._flags = {}
+            if self.cache_path.exists():
+                with open(self.cache_path, "r") as f:
+                    self._flags = {int(key): value for key, value in json.load(f).items()}
+        return self._flags
+
+    def flags(self, structure_klifs_ids):
+        """
+        Get curation flags for structures; only structures that are not cached are requested.
+
+        Parameters
+        ----------
+        structure_klifs_ids : list of int
+            Structure KLIFS IDs.
+
+        Returns
+        -------
+        dict of int: (bool or None)
+            Curation flag (values; None if structure is unknown to KLIFS) for all input
+            structure KLIFS IDs (keys).
+        """
+
+        structure_klifs_ids = [
+            int(structure_klifs_id) for structure_klifs_id in structure_klifs_ids
+        ]
+        cached_flags = self.cached_flags
+        new_ids = sorted({i for i in structure_klifs_ids if i not in cached_flags})
+        logger.info(
+            f"Curation flags: {len(structure_klifs_ids) - len(new_ids)} cached, "
+            f"{len(new_ids)} to request."
+        )
+
+        if len(new_ids) > 0:
+            if self.offline:
+                raise FileNotFoundError(
+                    f"Curation flags not cached (offline mode) for {len(new_ids)} structures, "
+                    f"e.g. {new_ids[:5]}."
+                )
+            chunks = [
+                new_ids[slice(start, start + self.chunk_size)]
+                for start in range(0, len(new_ids), self.chunk_size)
+            ]
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                for chunk, chunk_flags in zip(chunks, executor.map(self._request, chunks)):
+                    for structure_klifs_id in chunk:
+                        cached_flags[structure_klifs_id] = chunk_flags.get(structure_klifs_id)
+            n_unknown = sum(cached_flags[i] is None for i in new_ids)
+            if n_unknown > 0:
+                logger.warning(f"Structures unknown to KLIFS: {n_unknown}")
+            self._save()
+
+        return {i: cached_flags[i] for i in structure_klifs_ids}
+
+    def flagged(self, structure_klifs_ids):
+        """
+        Get flagged structures.
+
+        Parameters
+        ----------
+        structure_klifs_ids : list of int
+            Structure KLIFS IDs.
+
+        Returns
+        -------
+        set of int
+            Structure KLIFS IDs of flagged structures.
+        """
+
+        flags = self.flags(structure_klifs_ids)
+        return {structure_klifs_id for structure_klifs_id, flag in flags.items() if flag}
+
+    def clear(self):
+        """
+        Remove all cached flags for this KLIFS release.
+        """
+
+        if self.cache_path.exists():
+            self.cache_path.unlink()
+        self._flags = None
+
+    def _request(self, structure_klifs_ids):
+        """
+        Request curation flags for a chunk of structures from the KLIFS API.
+        """
+
+        query = urllib.parse.urlencode(
+            {"structure_ID": ",".join(str(i) for i in structure_klifs_ids)}
+        )
+        url = f"{self.api_url}/structure_list?{query}"
+        for attempt in range(self.retries + 1):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    structures = json.loads(response.read().decode())
+                break
+            except OSError as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Retry KLIFS request ({e}).")
+                time.sleep(2**attempt)
+        return {
+            int(structure["structure_ID"]): bool(structure["curation_flag"])
+            for structure in structures
+        }
+
+    def _save(self):
+        """
+        Save cached flags to the cache file.
+        """
+
+        flags = {str(key): value for key, value in sorted(self._flags.items())}
+        atomic_write(self.cache_path, lambda path: path.write_text(json.dumps(flags)))
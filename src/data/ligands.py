@@ -2,28 +2,42 @@
 Load ligand datasets.
 """
 
+import hashlib
 import logging
 from pathlib import Path
 
 import pandas as pd
-from rdkit.Chem import PandasTools
+
+from src.paths import PATH_DATA
+from src.utils import atomic_write
+from .name_index import NameIndex, persisted_index
 
 logger = logging.getLogger(__name__)
 
 DATA_PATH = Path(__file__).parent / "../../data/external/ligands"
 PKIDB_PATH = DATA_PATH / "PKIDB/pkidb_2021-04-19.sdf"
+PKIDB_CACHE_PATH = PATH_DATA / "interim/pkidb"
+
+# Name indices per PKIDB file checksum and FDA filter (built or loaded once per process)
+_pkidb_indices = {}
 
 
-def pkidb(pkidb_path=PKIDB_PATH, fda_approved=False):
+def pkidb(pkidb_path=PKIDB_PATH, fda_approved=False, molecules=True):
     """
     Load PKIDB ligand dataset.
 
+    The SDF properties are parsed once per SDF version (checksum) and cached as Parquet file;
+    RDKit molecules are only created if requested.
+
     Parameters
     ----------
     pkidb_path : str or pathlib.Path
         Path to PKIDB SDF download.
     fda_approved : bool
         Keep only FDA-approved PKIDB ligands (default: `False`).
+    molecules : bool
+        Add RDKit molecules in the column "ROMol" (default: `True`); skip them for faster
+        loading if only the ligand properties are needed.
 
     Returns
     -------
@@ -31,12 +45,17 @@ def pkidb(pkidb_path=PKIDB_PATH, fda_approved=False):
         PKIDB data (columns) for all PKIDB ligands (rows).
     """
 
-    pkidb_df = PandasTools.LoadSDF(str(pkidb_path))
+    pkidb_df = _pkidb_sdf(pkidb_path, molblocks=molecules)
     pkidb_df["BrandName"] = ["-" if i == "" else i for i in pkidb_df["BrandName"].to_list()]
     pkidb_df["Synonyms"] = [i.split(" | ") for i in pkidb_df["Synonyms"].to_list()]
     pkidb_df["Targets"] = [i.split("; ") for i in pkidb_df["Targets"]]
     pkidb_df["lig_pdbID"] = [i if len(i) == 0 else i[1:-1] for i in pkidb_df["lig_pdbID"]]
 
+    if molecules:
+        from rdkit import Chem
+
+        pkidb_df["ROMol"] = [Chem.MolFromMolBlock(i) for i in pkidb_df.pop("molblock")]
+
     # Filter for FDA-approved drugs
     if fda_approved:
         pkidb_df = pkidb_df[pkidb_df["FDA_approved"] == "Y"]
@@ -44,6 +63,144 @@ def pkidb(pkidb_path=PKIDB_PATH, fda_approved=False):
     return pkidb_df
 
 
+def _pkidb_sdf(pkidb_path=PKIDB_PATH, molblocks=False):
+    """
+    Load the PKIDB SDF properties (and molblocks) from the Parquet cache or, if not cached yet,
+    parse the SDF and cache the result.
+
+    Parameters
+    ----------
+    pkidb_path : str or pathlib.Path
+        Path to PKIDB SDF download.
+    molblocks : bool
+        Load molblocks in the column "molblock" (default: `False`).
+
+    Returns
+    -------
+    pandas.DataFrame
+        SDF properties and title ("ID") (columns) for all SDF records (rows).
+    """
+
+    pkidb_path = Path(pkidb_path)
+    checksum = _sha256(pkidb_path)
+    cache_path = PKIDB_CACHE_PATH / f"{pkidb_path.stem}_{checksum[:16]}.parquet"
+
+    if cache_path.exists():
+        try:
+            sdf_df = pd.read_parquet(cache_path)
+            return sdf_df if molblocks else sdf_df.drop("molblock", axis=1)
+        except (ImportError, OSError, ValueError) as e:
+            logger.warning(f"Parse SDF again, cached SDF could not be loaded: {e}")
+
+    logger.info(f"Parse SDF {pkidb_path.name}...")
+    sdf_df = _read_sdf(pkidb_path)
+    try:
+        atomic_write(cache_path, lambda path: sdf_df.to_parquet(path, index=False))
+    except (ImportError, OSError) as e:
+        logger.warning(f"Parsed SDF could not be cached: {e}")
+
+    return sdf_df if molblocks else sdf_df.drop("molblock", axis=1)
+
+
+def _read_sdf(sdf_path):
+    """
+    Parse SDF records (without RDKit) into the record properties, the record title ("ID"), and
+    the record molblock ("molblock"); property values are strings and multi-line values are
+    joined with newlines (same as `rdkit.Chem.PandasTools.LoadSDF`).
+
+    Parameters
+    ----------
+    sdf_path : str or pathlib.Path
+        Path to SDF file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        SDF properties, title, and molblock (columns) for all SDF records (rows).
+    """
+
+    # Keep carriage returns within property values (no universal newlines)
+    with open(sdf_path, "r", newline="") as f:
+        sdf_text = f.read()
+
+    records = []
+    for record_text in sdf_text.split("$$$$\n"):
+        if record_text.strip() == "":
+            continue
+        lines = record_text.split("\n")
+        end = next(i for i, line in enumerate(lines) if line.startswith("M  END"))
+        record = {}
+        i = end + 1
+        while i < len(lines):
+            line = lines[i]
+            i += 1
+            if not line.startswith(">"):
+                continue
+            # Property header, e.g. ">  <Synonyms>  (1) "
+            name = line.split("<", 1)[1].rsplit(">", 1)[0]
+            values = []
+            while i < len(lines) and lines[i] != "":
+                values.append(lines[i])
+                i += 1
+            record[name] = "\n".join(values)
+        record["ID"] = lines[0].strip()
+        record["molblock"] = "\n".join(lines[: end + 1]) + "\n"
+        records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def _sha256(path):
+    """
+    Get SHA-256 checksum of a file.
+    """
+
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def pkidb_index(pkidb_path=PKIDB_PATH, fda_approved=False):
+    """
+    Get name index that maps caseless ligand names (PKIDB IDs and synonyms) to PKIDB ligand IDs.
+    The index is built once per PKIDB dataset version and persisted on disk.
+
+    Parameters
+    ----------
+    pkidb_path : str or pathlib.Path
+        Path to PKIDB SDF download.
+    fda_approved : bool
+        Keep only FDA-approved PKIDB ligands (default: `False`).
+
+    Returns
+    -------
+    src.data.name_index.NameIndex
+        PKIDB name index; use `pkidb_index().resolve(ligand_names)` with casefolded ligand names
+        or `_pkidb_ligand_names(ligand_names)` to map ligand names.
+    """
+
+    checksum = _sha256(pkidb_path)
+    key = (checksum, fda_approved)
+
+    if key not in _pkidb_indices:
+
+        def _build_index():
+            pkidb_df = pkidb(pkidb_path, fda_approved, molecules=False)
+            # Make synonyms caseless for more generous caseless string matching
+            return NameIndex.from_entries(
+                pkidb_df["ID"],
+                [
+                    [synonym.casefold() for synonym in synonyms]
+                    for synonyms in pkidb_df["Synonyms"]
+                ],
+                source="PKIDB",
+                entity="ligand",
+            )
+
+        index_name = "pkidb_fda" if fda_approved else "pkidb"
+        _pkidb_indices[key] = persisted_index(index_name, checksum, _build_index)
+
+    return _pkidb_indices[key]
+
+
 def _pkidb_ligand_names(ligand_names, fda_approved=False):
     """
     Cast given ligand names to the PKIDB ligand IDs.
@@ -58,13 +215,14 @@ def _pkidb_ligand_names(ligand_names, fda_approved=False):
     Returns
     -------
     list of str
-        List of PKIDB ligand names.
+        List of PKIDB ligand names. If input ligand name unknown or ambiguous return
+        "unknown (why?)".
     """
 
-    pkidb_df = pkidb(fda_approved=fda_approved)
-    pkidb_ligand_names = [
-        _pkidb_ligand_name(ligand_name, pkidb_df) for ligand_name in ligand_names
-    ]
+    # Make everything caseless to more generous caseless string matching
+    pkidb_ligand_names = pkidb_index(fda_approved=fda_approved).resolve(
+        [ligand_name.casefold() for ligand_name in ligand_names]
+    )
 
     change_log = pd.DataFrame({"ligand.input": ligand_names, "ligand.pkidb": pkidb_ligand_names})
     change_log = change_log[change_log["ligand.input"] != change_log["ligand.pkidb"]]
@@ -75,36 +233,3 @@ def _pkidb_ligand_names(ligand_names, fda_approved=False):
         )
 
     return pkidb_ligand_names
-
-
-def _pkidb_ligand_name(ligand_name, pkidb_df):
-    """
-    Cast a given ligand name to the PKIDB ligand ID.
-
-    Parameters
-    ----------
-    ligand_name : str
-        Ligand name.
-    pkidb_df : pandas.DataFrame
-        PKIDB data (columns) for all PKIDB ligands (rows) from `ligands.pkidb()`.
-
-    Returns
-    -------
-    str
-        PKIDB ligand name. If input ligand name unknown or ambiguous return "unknown (why?)".
-    """
-
-    # Make everything caseless to more generous caseless string matching
-    ligand_name = ligand_name.casefold()
-    pkidb_df["Synonyms"] = pkidb_df["Synonyms"].apply(lambda x: [xx.casefold() for xx in x])
-
-    if pkidb_df["ID"].isin([ligand_name]).any():
-        return ligand_name
-    else:
-        ligand_name_pkidb = pkidb_df[pkidb_df["Synonyms"].apply(lambda x: ligand_name in x)]
-        if len(ligand_name_pkidb) == 0:
-            return "unknown (not in PKIDB)"
-        elif len(ligand_name_pkidb) == 1:
-            return ligand_name_pkidb.squeeze()["ID"]
-        else:
-            return "unknown (ambiguous ligand name)"
@@ -0,0 +1,208 @@
+"""
+Hash index to map names (IDs and aliases) to dataset IDs, e.g. kinase names to KinMap kinase
+names or ligand names to PKIDB ligand IDs.
+"""
+
+import json
+import logging
+from collections import defaultdict
+
+from src.paths import PATH_DATA
+from src.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = PATH_DATA / "interim/name_index"
+# Increase if the index format or how indices are built changes (invalidates persisted indices)
+INDEX_VERSION = 1
+
+
+class NameIndex:
+    """
+    Hash index that maps names to dataset IDs.
+    A name is mapped (1) to itself if it is a dataset ID, (2) to the dataset ID of the only
+    dataset entry that lists the name as alias, or (3) to "unknown (why?)" if no or multiple
+    dataset entries list the name as alias.
+
+    Attributes
+    ----------
+    ids : set of str
+        Dataset IDs.
+    aliases : dict of str: list of str
+        Dataset IDs (values) of all dataset entries that list an alias (keys); entries that
+        share an ID are listed separately.
+    source : str
+        Dataset name, e.g. "KinMap".
+    entity : str
+        Entity type, e.g. "kinase".
+    """
+
+    def __init__(self, ids, aliases, source, entity):
+
+        self.ids = set(ids)
+        self.aliases = dict(aliases)
+        self.source = source
+        self.entity = entity
+
+    @classmethod
+    def from_entries(cls, ids, aliases, source, entity):
+        """
+        Build index from dataset entries.
+
+        Parameters
+        ----------
+        ids : list of str
+            ID for each dataset entry.
+        aliases : list of list of str
+            Aliases for each dataset entry; missing values (None or NaN) are ignored.
+        source : str
+            Dataset name, e.g. "KinMap".
+        entity : str
+            Entity type, e.g. "kinase".
+
+        Returns
+        -------
+        src.data.name_index.NameIndex
+            Name index.
+        """
+
+        alias_ids = defaultdict(list)
+        for entry_id, entry_aliases in zip(ids, aliases):
+            # Count each entry only once per alias
+            for alias in {alias for alias in entry_aliases if isinstance(alias, str)}:
+                alias_ids[alias].append(entry_id)
+        return cls(ids, alias_ids, source, entity)
+
+    @property
+    def ambiguous_aliases(self):
+        """
+        Aliases that are listed by multiple dataset entries.
+
+        Returns
+        -------
+        dict of str: list of str
+            Dataset IDs (values) for ambiguous aliases (keys).
+        """
+
+        return {alias: ids for alias, ids in self.aliases.items() if len(ids) > 1}
+
+    def resolve(self, names):
+        """
+        Map names to dataset IDs.
+
+        Parameters
+        ----------
+        names : list of str
+            Names.
+
+        Returns
+        -------
+        list of str
+            Dataset IDs. If a name is unknown or ambiguous return "unknown (why?)".
+        """
+
+        return [self.resolve_name(name) for name in names]
+
+    def resolve_name(self, name):
+        """
+        Map a name to a dataset ID.
+
+        Parameters
+        ----------
+        name : str
+            Name.
+
+        Returns
+        -------
+        str
+            Dataset ID. If the name is unknown or ambiguous return "unknown (why?)".
+        """
+
+        if name in self.ids:
+            return name
+        alias_ids = self.aliases.get(name, [])
+        if len(alias_ids) == 0:
+            return f"unknown (not in {self.source})"
+        elif len(alias_ids) == 1:
+            return alias_ids[0]
+        else:
+            return f"unknown (ambiguous {self.entity} name)"
+
+    def to_json(self, index_path):
+        """
+        Save index to JSON file.
+
+        Parameters
+        ----------
+        index_path : str or pathlib.Path
+            Path to JSON file.
+        """
+
+        index_dict = {
+            "version": INDEX_VERSION,
+            "source": self.source,
+            "entity": self.entity,
+            "ids": sorted(self.ids),
+            "aliases": self.aliases,
+        }
+        atomic_write(index_path, lambda path: path.write_text(json.dumps(index_dict)))
+
+    @classmethod
+    def from_json(cls, index_path):
+        """
+        Load index from JSON file.
+
+        Parameters
+        ----------
+        index_path : str or pathlib.Path
+            Path to JSON file.
+
+        Returns
+        -------
+        src.data.name_index.NameIndex
+            Name index.
+        """
+
+        with open(index_path, "r") as f:
+            index_dict = json.load(f)
+        if index_dict["version"] != INDEX_VERSION:
+            raise ValueError(f"Outdated name index version: {index_dict['version']}")
+        return cls(
+            index_dict["ids"], index_dict["aliases"], index_dict["source"], index_dict["entity"]
+        )
+
+
+def persisted_index(index_name, checksum, build_index):
+    """
+    Load a name index from disk or, if not available, build and save it.
+    Indices are persisted per index name, source data checksum, and index version.
+
+    Parameters
+    ----------
+    index_name : str
+        Index name, e.g. "kinmap".
+    checksum : str
+        Checksum of the source data the index is built from.
+    build_index : callable
+        Function without arguments that builds the `NameIndex`.
+
+    Returns
+    -------
+    src.data.name_index.NameIndex
+        Name index.
+    """
+
+    index_path = INDEX_PATH / f"{index_name}_{checksum[:16]}_v{INDEX_VERSION}.json"
+    if index_path.exists():
+        try:
+            return NameIndex.from_json(index_path)
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Rebuild name index {index_path.name}: {e}")
+
+    logger.info(f"Build name index {index_path.name}...")
+    index = build_index()
+    try:
+        index.to_json(index_path)
+    except OSError as e:
+        logger.warning(f"Name index could not be saved: {e}")
+    return index
@@ -0,0 +1,269 @@
+"""
+Encode KLIFS pocket sequences and compare them.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Number of KLIFS pocket residues
+POCKET_LENGTH = 85
+
+
+def encode_pockets(pocket_sequences):
+    """
+    Encode KLIFS pocket sequences as small integer codes.
+
+    Parameters
+    ----------
+    pocket_sequences : list of str or pandas.Series
+        KLIFS pocket sequences (one-letter amino acid codes); all sequences must have the same
+        length (85 residues for KLIFS pockets).
+
+    Returns
+    -------
+    codes : numpy.ndarray
+        Residue codes (uint8) for all pockets (rows) and pocket positions (columns).
+    alphabet : numpy.ndarray
+        Residue letters; `alphabet[code]` is the residue letter encoded by `code`.
+    """
+
+    pocket_sequences = list(pocket_sequences)
+    if len(pocket_sequences) == 0:
+        return np.empty((0, 0), dtype=np.uint8), np.empty(0, dtype="U1")
+    if len(set(len(pocket_sequence) for pocket_sequence in pocket_sequences)) > 1:
+        raise ValueError("Pocket sequences must have the same length.")
+
+    # One byte per residue letter
+    ascii_codes = np.frombuffer("".join(pocket_sequences).encode("ascii"), dtype=np.uint8)
+    ascii_codes = ascii_codes.reshape(len(pocket_sequences), -1)
+    # Map bytes to consecutive codes 0, 1, ..., n_letters - 1
+    # (lookup table over all 256 byte values instead of sorting all residues)
+    letters = np.flatnonzero(np.bincount(ascii_codes.ravel(), minlength=256))
+    lookup = np.zeros(256, dtype=np.uint8)
+    lookup[letters] = np.arange(len(letters))
+    codes = lookup[ascii_codes]
+    alphabet = np.array([chr(letter) for letter in letters], dtype="U1")
+
+    return codes, alphabet
+
+
+def pocket_identity_matrix(codes, block_size=1024, dtype=np.float64):
+    """
+    Count the identical pocket positions for all pairs of encoded pockets.
+
+    Identity counts are calculated as a sum of per-letter one-hot matrix products, i.e. as one
+    product of the flattened N x (positions * letters) one-hot matrix with its transpose. The
+    product is calculated in blocks of `block_size` rows, so that the memory needed on top of
+    the N x N output is bounded by the one-hot matrix plus one `block_size` x N block.
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        Residue codes for all pockets (rows) and pocket positions (columns) from
+        `encode_pockets`.
+    block_size : int
+        Number of pockets (rows) processed per block.
+    dtype : numpy.dtype
+        Output data type, e.g. `numpy.float32` to halve the output memory (default:
+        `numpy.float64`).
+
+    Returns
+    -------
+    numpy.ndarray
+        Number of identical pocket positions for all pocket pairs (N x N).
+    """
+
+    n_pockets, n_positions = codes.shape
+    n_letters = int(codes.max()) + 1 if codes.size > 0 else 0
+
+    # One-hot encoding: One column per position-letter combination
+    # Counts up to 85 are exact in float32
+    one_hot = np.zeros((n_pockets, n_positions * n_letters), dtype=np.float32)
+    columns = np.arange(n_positions) * n_letters + codes
+    one_hot[np.arange(n_pockets)[:, None], columns] = 1
+
+    identity_matrix = np.empty((n_pockets, n_pockets), dtype=dtype)
+    for start in range(0, n_pockets, block_size):
+        end = min(start + block_size, n_pockets)
+        identity_matrix[start:end] = one_hot[start:end] @ one_hot.T
+
+    return identity_matrix
+
+
+def pocket_mutations(structure_pockets, kinase_pockets):
+    """
+    Find mutated pocket positions by comparing KLIFS structure pocket sequences to their KLIFS
+    kinase pocket sequences. Gaps in the structure ("_") or kinase ("-") pocket are omitted, any
+    other positional mismatch is a mutation.
+
+    Parameters
+    ----------
+    structure_pockets : list of str or pandas.Series
+        KLIFS structure pocket sequences.
+    kinase_pockets : list of str or pandas.Series
+        KLIFS kinase pocket sequences (one per structure pocket, same lengths).
+
+    Returns
+    -------
+    numpy.ndarray
+        Mutation mask (bool) for all structures (rows) and pocket positions (columns); the number
+        of mutations per structure is `mutations.sum(axis=1)`.
+    """
+
+    structure_pockets = list(structure_pockets)
+    kinase_pockets = list(kinase_pockets)
+    if len(structure_pockets) != len(kinase_pockets):
+        raise ValueError("Number of structure and kinase pocket sequences must be the same.")
+    n_structures = len(structure_pockets)
+    if n_structures == 0:
+        return np.empty((0, 0), dtype=bool)
+
+    # Encode structure and kinase pockets with the same alphabet
+    codes, alphabet = encode_pockets(structure_pockets + kinase_pockets)
+    structure_codes, kinase_codes = codes[:n_structures], codes[n_structures:]
+    # Code for a letter that is not in the alphabet: matches no position
+    structure_gap = np.flatnonzero(alphabet == "_")[0] if "_" in alphabet else len(alphabet)
+    kinase_gap = np.flatnonzero(alphabet == "-")[0] if "-" in alphabet else len(alphabet)
+
+    mutations = structure_codes != kinase_codes
+    mutations &= structure_codes != structure_gap
+    mutations &= kinase_codes != kinase_gap
+    return mutations
+
+
+class PocketMatrix:
+    """
+    Encoded KLIFS pocket sequences of a structures DataFrame for fast per-position counts.
+
+    Attributes
+    ----------
+    codes : numpy.ndarray
+        Residue codes (uint8) for all structures (rows) and pocket positions (columns).
+    alphabet : numpy.ndarray
+        Residue letters; `alphabet[code]` is the residue letter encoded by `code`.
+    positions : pandas.Index
+        Pocket residue positions (KLIFS residue IDs 1-85).
+    """
+
+    def __init__(self, pocket_sequences):
+        """
+        Initialize PocketMatrix.
+
+        Parameters
+        ----------
+        pocket_sequences : list of str or pandas.Series
+            KLIFS pocket sequences (one-letter amino acid codes, 85 residues).
+        """
+
+        self.codes, self.alphabet = encode_pockets(pocket_sequences)
+        if len(self.codes) == 0:
+            self.codes = np.empty((0, POCKET_LENGTH), dtype=np.uint8)
+        elif self.codes.shape[1] != POCKET_LENGTH:
+            raise ValueError(f"Pocket sequences must have {POCKET_LENGTH} residues.")
+        self.positions = pd.RangeIndex(1, POCKET_LENGTH + 1)
+
+    @classmethod
+    def from_structures(cls, structures):
+        """
+        Get pocket matrix for a structures DataFrame. Build it once and reuse it for several
+        counts on the same structures (e.g. the `pocket_matrix` argument of the explorer plots).
+
+        Parameters
+        ----------
+        structures : pandas.DataFrame
+            Structures DataFrame from opencadd.databases.klifs module.
+
+        Returns
+        -------
+        src.data.pockets.PocketMatrix
+            Pocket matrix.
+        """
+
+        return cls(structures["structure.pocket"])
+
+    def residue_mask(self, residue):
+        """
+        Find a residue letter in all pockets.
+
+        Parameters
+        ----------
+        residue : str
+            Residue letter, e.g. "_" for missing or "X" for modified residues.
+
+        Returns
+        -------
+        numpy.ndarray
+            Mask (bool) for all structures (rows) and pocket positions (columns).
+        """
+
+        if residue not in self.alphabet:
+            return np.zeros(self.codes.shape, dtype=bool)
+        return self.codes == np.flatnonzero(self.alphabet == residue)[0]
+
+    def residue_counts(self, residue):
+        """
+        Count a residue letter per pocket position across all pockets.
+
+        Parameters
+        ----------
+        residue : str
+            Residue letter, e.g. "_" for missing or "X" for modified residues.
+
+        Returns
+        -------
+        pandas.Series
+            Number of structures (values) with this residue for all pocket positions (index).
+        """
+
+        counts = self.residue_mask(residue).sum(axis=0)
+        return pd.Series(counts, index=self.positions)
+
+    def missing_residues(self):
+        """
+        Number of missing residues ("_") per pocket position.
+
+        Returns
+        -------
+        pandas.Series
+            Number of structures (values) with missing residue for all pocket positions (index).
+        """
+
+        return self.residue_counts("_")
+
+    def modified_residues(self):
+        """
+        Number of modified residues ("X") per pocket position.
+
+        Returns
+        -------
+        pandas.Series
+            Number of structures (values) with modified residue for all pocket positions (index).
+        """
+
+        return self.residue_counts("X")
+
+    def missing_subpockets(self, anchor_residues):
+        """
+        Number of missing anchor residues per subpocket (summed over the subpocket's anchor
+        residues).
+
+        Parameters
+        ----------
+        anchor_residues : dict (str: list of int)
+            Dictionary of anchor residues (values: list of residue KLIFS IDs) for one or more
+            subpockets (keys: subpocket name).
+
+        Returns
+        -------
+        pandas.Series
+            Number of missing anchor residues (values) for all subpockets (index).
+        """
+
+        missing_residues = self.missing_residues()
+        return pd.Series(
+            {key: missing_residues[value].sum() for key, value in anchor_residues.items()}
+        )
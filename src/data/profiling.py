@@ -5,11 +5,15 @@ Load profiling datasets (in unified output format).
 import logging
 from pathlib import Path
 import json
+import re
 
 import pandas as pd
 import numpy as np
 
+from src.paths import PATH_DATA
+from src.utils import atomic_write
 from . import ligands, kinases
+from .registry import DatasetRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +22,31 @@ KARAMAN_PATH = DATA_PATH / "Karaman/Karaman_profiling.js"
 DAVIS_PATH = DATA_PATH / "Davis/Davis_profiling.js"
 PKIS2_PATH = DATA_PATH / "PKIS2/pone.0181585.s004.xlsx"
 MORET_PATH = DATA_PATH / "Moret/compound-library-2022-04-16.csv"
+PKIS2_SNAPSHOT_PATH = PATH_DATA / "interim/pkis2"
+# Increase if the normalization of the PKIS2 dataset changes (invalidates snapshots)
+PKIS2_SNAPSHOT_VERSION = 1
+
+# Datasets available via `load` (memoized per load options and dataset file versions);
+# DO NOT USE underscores in dataset name
+_NAME_MAPPING_PATHS = [ligands.PKIDB_PATH, kinases.KINMAP_PATH]
+_registry = DatasetRegistry()
+_registry.register(
+    "karaman", lambda **options: karaman(**options), [KARAMAN_PATH] + _NAME_MAPPING_PATHS
+)
+_registry.register("davis", lambda **options: davis(**options), [DAVIS_PATH] + _NAME_MAPPING_PATHS)
+_registry.register(
+    "karaman-davis",
+    lambda **options: karaman_davis(**options),
+    [KARAMAN_PATH, DAVIS_PATH] + _NAME_MAPPING_PATHS,
+)
+_registry.register("moret", lambda **options: moret(**options), [MORET_PATH] + _NAME_MAPPING_PATHS)
+
+# Tokens in the KinMap JS profiling object: ligand key with its list of measurement objects, and
+# measurement object with a numeric Kd value in the KinMap field order (fast path)
+_KINMAP_LIGAND = re.compile(r'\s*,?\s*"((?:[^"\\]|\\.)*)"\s*:\s*\[([^\]]*)\]')
+_KINMAP_MEASUREMENT = re.compile(
+    r'\{\s*"Kd\(nM\)"\s*:\s*([-+.0-9eE]+)\s*,\s*"xName"\s*:\s*"([^"\\]*)"\s*\}'
+)
 
 
 def load(dataset_name, pkidb_ligands=False, fda_approved=False, kinmap_kinases=False):
@@ -40,20 +69,21 @@ def load(dataset_name, pkidb_ligands=False, fda_approved=False, kinmap_kinases=F
     -------
     pandas.DataFrame
         Profiling data for different kinases (rows) and ligands (columns).
+
+    Notes
+    -----
+    Datasets are loaded once per process and load options (and reloaded if the dataset files
+    change); the returned DataFrame shares its values with the memoized dataset, so do not
+    modify it in place (e.g. `df.iloc[0, 0] = 0` or `df.fillna(0, inplace=True)`) but work on
+    `df.copy()` instead.
     """
 
-    if dataset_name == "karaman":
-        return karaman(pkidb_ligands, fda_approved, kinmap_kinases)
-    elif dataset_name == "davis":
-        return davis(pkidb_ligands, fda_approved, kinmap_kinases)
-    elif dataset_name == "karaman-davis":
-        return karaman_davis(pkidb_ligands, fda_approved, kinmap_kinases)
-    elif dataset_name == "moret":
-        return moret(pkidb_ligands, fda_approved, kinmap_kinases)
-    else:
-        raise KeyError(
-            "Unknown dataset name. Use 'karaman', 'davis', 'karaman-davis', or 'moret'."
-        )
+    return _registry.load(
+        dataset_name,
+        pkidb_ligands=pkidb_ligands,
+        fda_approved=fda_approved,
+        kinmap_kinases=kinmap_kinases,
+    )
 
 
 def karaman(pkidb_ligands=False, fda_approved=False, kinmap_kinases=False, data_path=KARAMAN_PATH):
@@ -151,48 +181,6 @@ def karaman_davis(
         Combined profiling data from Karaman and Davis datasets.
     """
 
-    cases = {
-        1: "No measurements",
-        2: "One measurement",
-        3: "Two identical measurements",
-        4: f"Two measurements <= or > cutoff {activity_max}; keep lower value",
-        5: (
-            f"One measurement <=, one > cutoff {activity_max} "
-            f"but difference <= {activity_diff}; keep lower value"
-        ),
-        6: (
-            f"One measurement <=, one > cutoff {activity_max} "
-            f"but difference > {activity_diff}; remove values"
-        ),
-    }
-
-    def _choose_from_multiple_activities(x, activity_max=100, _stats=False):
-        """
-        Choose an activity from zero, one, or two activities.
-        """
-
-        if len(x) == 0:
-            return None if not _stats else 1
-        elif len(x) == 1:
-            return x[0] if not _stats else 2
-        else:
-            if x[0] == x[1]:
-                return x[0] if not _stats else 3
-            else:
-                # If both measurements are below or above cutoff, keep lower value
-                if (x[0] > activity_max and x[1] > activity_max) or (
-                    x[0] <= activity_max and x[1] <= activity_max
-                ):
-                    return min(x) if not _stats else 4
-                # If one is below and one above
-                else:
-                    # Keep lower value if difference between values is <100
-                    if abs(x[0] - x[1]) <= activity_diff:
-                        return min(x) if not _stats else 5
-                    # Else remove measurements completely (unreliable)
-                    else:
-                        return None if not _stats else 6
-
     df_karaman = karaman(pkidb_ligands, fda_approved, kinmap_kinases)
     logger.info(f"Karaman matrix: {df_karaman.shape}")
     df_davis = davis(pkidb_ligands, fda_approved, kinmap_kinases)
@@ -210,27 +198,114 @@ def karaman_davis(
         f"Number of total kinases: {len(set(df_karaman.index).union(set(df_davis.index)))}"
     )
 
-    df_combined = pd.concat([df_karaman, df_davis])
-    df_combined = (
-        df_combined.reset_index()
-        .groupby("index")
-        .agg(lambda x: [i for i in x.tolist() if not np.isnan(i)])
-    )
+    df_combined, case_counts = merge([df_karaman, df_davis], activity_max, activity_diff)
     logger.info(f"Karaman-Davis matrix: {df_combined.shape}")
 
-    df_combined_selected = df_combined.applymap(
-        lambda x: _choose_from_multiple_activities(x, activity_max)
+    # Print statistics on different cases
+    logger.info(f"Cases:\n{case_counts[case_counts['n_cells'] > 0].to_string()}")
+
+    return df_combined
+
+
+def merge(profiling_dfs, activity_max=100, activity_diff=100):
+    """
+    Combine profiling data from multiple datasets.
+    - (1) If no measurement, return None.
+    - (2) If one measurement, return that value.
+    - (3) If multiple identical measurements, return that value.
+    - (4) If all measurements are <= or > cutoff, keep lowest value.
+    - If some are below and some above,
+      - (5) keep lowest value if difference between lowest and highest value is <= cutoff,
+      - (6) else remove measurements.
+
+    The cases are evaluated for all kinase-ligand cells at once based on the number of
+    measurements and the lowest and highest measurement per cell (for two datasets, cases are
+    the same as comparing both measurements).
+
+    Parameters
+    ----------
+    profiling_dfs : list of pandas.DataFrame
+        Profiling data for different kinases (rows) and ligands (columns) per dataset.
+    activity_max : int
+        Maximum cutoff for activity definition.
+    activity_diff : int
+        Allowed activity difference for case (5).
+
+    Returns
+    -------
+    df_combined : pandas.DataFrame
+        Combined profiling data for all kinases (rows, sorted) and ligands (columns, in order of
+        appearance).
+    case_counts : pandas.DataFrame
+        Case description and number of kinase-ligand cells (columns) per case (rows).
+    """
+
+    cases = {
+        1: "No measurements",
+        2: "One measurement",
+        3: "Multiple identical measurements",
+        4: f"Multiple measurements all <= or all > cutoff {activity_max}; keep lowest value",
+        5: (
+            f"Measurements <= and > cutoff {activity_max} "
+            f"but difference <= {activity_diff}; keep lowest value"
+        ),
+        6: (
+            f"Measurements <= and > cutoff {activity_max} "
+            f"but difference > {activity_diff}; remove values"
+        ),
+    }
+
+    kinase_names = pd.Index(sorted(set().union(*[df.index for df in profiling_dfs])))
+    ligand_names = pd.Index(pd.unique(np.concatenate([df.columns for df in profiling_dfs])))
+    n_cells = len(kinase_names) * len(ligand_names)
+
+    # Measurements as (cell, value) pairs, cells flattened from (kinase, ligand)
+    cells = []
+    values = []
+    for df in profiling_dfs:
+        matrix = df.to_numpy(dtype=np.float64)
+        measured = ~np.isnan(matrix)
+        rows, columns = np.nonzero(measured)
+        rows = kinase_names.get_indexer(df.index)[rows]
+        columns = ligand_names.get_indexer(df.columns)[columns]
+        cells.append(rows * len(ligand_names) + columns)
+        values.append(matrix[measured])
+    cells = np.concatenate(cells)
+    values = np.concatenate(values)
+
+    n_measurements = np.bincount(cells, minlength=n_cells)
+    minimum = np.full(n_cells, np.inf)
+    np.minimum.at(minimum, cells, values)
+    maximum = np.full(n_cells, -np.inf)
+    np.maximum.at(maximum, cells, values)
+
+    case = np.select(
+        [
+            n_measurements == 0,
+            n_measurements == 1,
+            minimum == maximum,
+            (minimum > activity_max) | (maximum <= activity_max),
+            maximum - minimum <= activity_diff,
+        ],
+        [1, 2, 3, 4, 5],
+        6,
+    )
+    combined = np.where((case == 1) | (case == 6), np.nan, minimum)
+    df_combined = pd.DataFrame(
+        combined.reshape(len(kinase_names), len(ligand_names)),
+        index=kinase_names,
+        columns=ligand_names,
     )
-    df_combined_selected.index.name = None
-    logger.info(f"Karaman-Davis matrix: {df_combined.shape}")
 
-    # Print statistics on different cases
-    stats = df_combined.applymap(
-        lambda x: _choose_from_multiple_activities(x, activity_max, _stats=True)
+    case_counts = pd.DataFrame(
+        {
+            "description": pd.Series(cases),
+            "n_cells": np.bincount(case, minlength=len(cases) + 1)[1:],
+        }
     )
-    logger.info(stats.unstack().value_counts().sort_index().rename(cases))
+    case_counts.index.name = "case"
 
-    return df_combined_selected
+    return df_combined, case_counts
 
 
 def _kinmap_profiling(
@@ -261,23 +336,7 @@ def _kinmap_profiling(
         Profiling data for different kinases (rows) and ligands (columns).
     """
 
-    with open(data_path, "r") as f:
-        json_string = f.read()
-
-    json_string_cleaned = json_string.replace("=", ": ").replace(";", ", ").replace("\n", "")
-    json_string_cleaned = json_string_cleaned.replace(
-        f"{data_name}_compounds", f'"{data_name}_compounds"'
-    )
-    json_string_cleaned = json_string_cleaned.replace(
-        f"{data_name}_profiling", f'"{data_name}_profiling"'
-    )
-    json_string_cleaned = json_string_cleaned[:-3] + "}"
-    data_dict = json.loads(json_string_cleaned)
-
-    data_df = {}
-    for ligand, measures in data_dict[f"{data_name}_profiling"].items():
-        data_df[ligand] = {measure["xName"]: measure["Kd(nM)"] for measure in measures}
-    data_df = pd.DataFrame(data_df)
+    data_df = _read_kinmap_profiling(data_path, data_name)
 
     if pkidb_ligands:
         data_df = _pkidb_ligands(data_df, fda_approved)
@@ -287,6 +346,93 @@ def _kinmap_profiling(
     return data_df
 
 
+def _read_kinmap_profiling(data_path, data_name):
+    """
+    Read profiling dataset from KinMap (JS file).
+
+    The JS file assigns JSON values to variables, e.g. `{data_name}_compounds=[...];` and
+    `{data_name}_profiling={"ligand": [{"Kd(nM)": 1.2, "xName": "kinase"}, ...], ...};`.
+    The profiling object is tokenized into ligand keys and measurement objects; the
+    (ligand, kinase, Kd) triples are collected in preallocated arrays (ligands and kinases as
+    categorical codes in order of appearance) and pivoted into the profiling matrix.
+
+    Parameters
+    ----------
+    data_path : str or pathlib.Path
+        Path to profiling dataset (JS file from KinMap).
+    data_name : str
+        Dataset name as used in the JS file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Profiling data for different kinases (rows) and ligands (columns).
+    """
+
+    with open(data_path, "r") as f:
+        js_string = f.read()
+
+    match = re.search(rf"\b{re.escape(data_name)}_profiling\s*=\s*\{{", js_string)
+    if match is None:
+        raise ValueError(f"No {data_name}_profiling object in {data_path}.")
+    # One measurement object per (ligand, kinase) pair
+    n_measurements = js_string.count('"xName"', match.end())
+
+    ligand_codes = np.empty(n_measurements, dtype=np.int32)
+    kinase_names = np.empty(n_measurements, dtype=object)
+    values = np.empty(n_measurements, dtype=np.float64)
+    ligand_names = {}
+
+    i = 0
+    position = match.end()
+    while True:
+        token = _KINMAP_LIGAND.match(js_string, position)
+        if token is None:
+            break
+        position = token.end()
+        ligand_name, measurements = token.groups()
+        ligand_name = json.loads(f'"{ligand_name}"')
+        ligand_code = ligand_names.setdefault(ligand_name, len(ligand_names))
+
+        measurements_fast = _KINMAP_MEASUREMENT.findall(measurements)
+        if len(measurements_fast) == measurements.count("{"):
+            kds = [float(kd) for kd, _ in measurements_fast]
+            kinases = [kinase for _, kinase in measurements_fast]
+        else:
+            measurements = json.loads(f"[{measurements}]")
+            kds = [measurement["Kd(nM)"] for measurement in measurements]
+            kds = [np.nan if kd is None else kd for kd in kds]
+            kinases = [measurement["xName"] for measurement in measurements]
+        n = len(kds)
+        if i + n > n_measurements:
+            raise ValueError(f"Unexpected measurement format in {data_path}.")
+        measurement_slice = slice(i, i + n)
+        ligand_codes[measurement_slice] = ligand_code
+        kinase_names[measurement_slice] = kinases
+        values[measurement_slice] = kds
+        i += n
+
+    if js_string[position:].lstrip()[:1] != "}":
+        raise ValueError(
+            f"Unexpected token in {data_name}_profiling object in {data_path}: "
+            f"{js_string[position:position + 50]}"
+        )
+    if i != n_measurements:
+        raise ValueError(f"Expected {n_measurements} measurements but found {i} in {data_path}.")
+
+    # Categorical codes in order of appearance
+    kinase_codes, kinase_names = pd.factorize(kinase_names)
+    # Keep the last measurement per (ligand, kinase) pair
+    pair_codes = kinase_codes.astype(np.int64) * len(ligand_names) + ligand_codes
+    _, last = np.unique(pair_codes[::-1], return_index=True)
+    last = n_measurements - 1 - last
+
+    matrix = np.full((len(kinase_names), len(ligand_names)), np.nan)
+    matrix[kinase_codes[last], ligand_codes[last]] = values[last]
+
+    return pd.DataFrame(matrix, index=list(kinase_names), columns=list(ligand_names))
+
+
 def _pkidb_ligands(profiling_df, fda_approved=False):
     """
     Cast ligand names in DataFrame (columns) to PKIDB ligand names.
@@ -327,17 +473,106 @@ def _kinmap_kinases(profiling_df):
     return profiling_df
 
 
-def pkis2(kinmap_kinases=False, data_path=PKIS2_PATH):
+def pkis2(kinmap_kinases=False, data_path=PKIS2_PATH, snapshot_path=PKIS2_SNAPSHOT_PATH):
     """
     Load PKIS2 dataset.
     TODO cast ligand names to PKIDB ligand names.
 
+    The normalized dataset is loaded from a Parquet snapshot; if no snapshot exists for the
+    current Excel file (checksum in snapshot manifest), the snapshot is created first (see
+    `pkis2_snapshot`).
+
     Parameters
     ----------
     kinmap_kinases : bool
         Map kinase names to KinMap kinase names (default: False).
     data_path : str or pathlib.Path
         Path to PKIS2 dataset.
+    snapshot_path : str or pathlib.Path
+        Path to PKIS2 snapshot folder.
+
+    Returns
+    -------
+    pandas.DataFrame
+        PKIS2 profiling data for different kinases (rows) and ligands (columns).
+    """
+
+    snapshot_path = Path(snapshot_path)
+    manifest_path = snapshot_path / "manifest.json"
+    df = None
+
+    if manifest_path.exists():
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == PKIS2_SNAPSHOT_VERSION and manifest.get(
+            "source_sha256"
+        ) == ligands._sha256(data_path):
+            try:
+                df = pd.read_parquet(snapshot_path / manifest["snapshot"], memory_map=True)
+            except (ImportError, OSError, ValueError) as e:
+                logger.warning(f"PKIS2 snapshot could not be loaded: {e}")
+        else:
+            logger.info("PKIS2 snapshot is outdated.")
+
+    if df is None:
+        df = pkis2_snapshot(data_path, snapshot_path)
+
+    if kinmap_kinases:
+        df = _kinmap_kinases(df)
+
+    return df
+
+
+def pkis2_snapshot(data_path=PKIS2_PATH, snapshot_path=PKIS2_SNAPSHOT_PATH):
+    """
+    Convert the PKIS2 Excel file to a normalized Parquet snapshot with a manifest (JSON file
+    with source file checksum, snapshot version, and matrix shape).
+
+    Parameters
+    ----------
+    data_path : str or pathlib.Path
+        Path to PKIS2 dataset.
+    snapshot_path : str or pathlib.Path
+        Path to PKIS2 snapshot folder.
+
+    Returns
+    -------
+    pandas.DataFrame
+        PKIS2 profiling data for different kinases (rows) and ligands (columns).
+    """
+
+    logger.info(f"Convert PKIS2 dataset {Path(data_path).name} to snapshot...")
+    df = _read_pkis2(data_path)
+
+    snapshot_path = Path(snapshot_path)
+    manifest = {
+        "version": PKIS2_SNAPSHOT_VERSION,
+        "source": Path(data_path).name,
+        "source_sha256": ligands._sha256(data_path),
+        "snapshot": f"pkis2_v{PKIS2_SNAPSHOT_VERSION}.parquet",
+        "shape": list(df.shape),
+    }
+    try:
+        # Write manifest last so that it only lists complete snapshots
+        atomic_write(snapshot_path / manifest["snapshot"], df.to_parquet)
+        atomic_write(
+            snapshot_path / "manifest.json",
+            lambda path: path.write_text(json.dumps(manifest, indent=4)),
+        )
+    except (ImportError, OSError) as e:
+        logger.warning(f"PKIS2 snapshot could not be saved: {e}")
+
+    return df
+
+
+def _read_pkis2(data_path=PKIS2_PATH):
+    """
+    Read and normalize the PKIS2 dataset from the Excel file.
+
+    Parameters
+    ----------
+    data_path : str or pathlib.Path
+        Path to PKIS2 dataset.
 
     Returns
     -------
@@ -425,13 +660,16 @@ def pkis2(kinmap_kinases=False, data_path=PKIS2_PATH):
     df = df.reset_index().drop_duplicates("index").set_index("index")
     df.index.name = "kinase"
 
-    if kinmap_kinases:
-        df = _kinmap_kinases(df)
-
     return df
 
 
-def moret(pkidb_ligands=False, fda_approved=False, kinmap_kinases=False, data_path=MORET_PATH):
+def moret(
+    pkidb_ligands=False,
+    fda_approved=False,
+    kinmap_kinases=False,
+    data_path=MORET_PATH,
+    chunksize=100000,
+):
     """
     Load Moret profiling dataset from [1]. Dataset was downloaded as described in
     ´kissim_app/data/external/profiling/Moret/README.md`.
@@ -451,6 +689,9 @@ def moret(pkidb_ligands=False, fda_approved=False, kinmap_kinases=False, data_pa
         Map kinase names to KinMap kinase names (default: False).
     data_path : str or pathlib.Path
         Path to Moret dataset.
+    chunksize : int
+        Number of CSV rows read at once; memory is bounded by the chunk size plus (about twice)
+        the number of unique kinase-ligand pairs.
 
     Returns
     -------
@@ -458,14 +699,33 @@ def moret(pkidb_ligands=False, fda_approved=False, kinmap_kinases=False, data_pa
         Moret profiling data for different kinases (rows) and ligands (columns).
     """
 
-    data_df = pd.read_csv(data_path)
-    # Sort kinase-ligand pairs by ascending IC50 values
-    data_df = data_df.sort_values(["symbol", "name", "ontarget_ic50_q1"])
-    # Per kinase-ligand pair select lowest IC50 value
-    data_df = data_df.groupby(["symbol", "name"]).first().reset_index()
+    # Per kinase-ligand pair keep lowest IC50 value: Reduce each chunk to its per-pair minima
+    # and fold these into the running minima
+    chunks = pd.read_csv(
+        data_path,
+        usecols=["symbol", "name", "ontarget_ic50_q1"],
+        dtype={"symbol": str, "name": str, "ontarget_ic50_q1": np.float64},
+        chunksize=chunksize,
+    )
+    ic50 = pd.Series(
+        dtype=np.float64, index=pd.MultiIndex.from_arrays([[], []], names=["symbol", "name"])
+    )
+    chunk_ic50s = []
+    n_chunk_ic50s = 0
+    for chunk in chunks:
+        chunk_ic50 = chunk.groupby(["symbol", "name"])["ontarget_ic50_q1"].min()
+        chunk_ic50s.append(chunk_ic50)
+        n_chunk_ic50s += len(chunk_ic50)
+        # Fold pending chunk minima into the running minima only once they outgrow them
+        if n_chunk_ic50s > len(ic50):
+            ic50 = _min_per_pair([ic50] + chunk_ic50s)
+            chunk_ic50s = []
+            n_chunk_ic50s = 0
+    if chunk_ic50s:
+        ic50 = _min_per_pair([ic50] + chunk_ic50s)
 
     # Transpose kinase-ligand pairs to kinase-ligand matrix
-    matrix_df = data_df.pivot(index="symbol", columns="name", values="ontarget_ic50_q1")
+    matrix_df = ic50.unstack("name")
 
     if pkidb_ligands:
         matrix_df = _pkidb_ligands(matrix_df, fda_approved)
@@ -474,3 +734,21 @@ def moret(pkidb_ligands=False, fda_approved=False, kinmap_kinases=False, data_pa
         matrix_df = _kinmap_kinases(matrix_df)
 
     return matrix_df
+
+
+def _min_per_pair(ic50s):
+    """
+    Get the lowest IC50 value per kinase-ligand pair across IC50 series.
+
+    Parameters
+    ----------
+    ic50s : list of pandas.Series
+        IC50 values per kinase-ligand pair (index: symbol, name).
+
+    Returns
+    -------
+    pandas.Series
+        Lowest IC50 value per kinase-ligand pair.
+    """
+
+    return pd.concat(ic50s).groupby(level=[0, 1]).min()
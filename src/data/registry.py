@@ -0,0 +1,120 @@
+"""
+Registry of datasets that are loaded lazily and memoized in-process.
+"""
+
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetRegistry:
+    """
+    Registry of dataset loaders; loaded datasets are memoized per dataset name, load options,
+    and dataset file paths and modification times, and evicted in least recently used order.
+
+    Attributes
+    ----------
+    max_size : int
+        Maximum number of memoized datasets.
+    loaders : dict of str: tuple
+        Dataset loader and dataset file paths (values) for all dataset names (keys).
+    """
+
+    def __init__(self, max_size=16):
+
+        self.max_size = max_size
+        self.loaders = {}
+        self._datasets = OrderedDict()
+
+    @property
+    def names(self):
+        """
+        Registered dataset names.
+
+        Returns
+        -------
+        list of str
+            Dataset names.
+        """
+
+        return list(self.loaders)
+
+    def register(self, name, loader, paths=None):
+        """
+        Register a dataset loader.
+
+        Parameters
+        ----------
+        name : str
+            Dataset name.
+        loader : callable
+            Function that loads the dataset; called with the load options as keyword arguments.
+        paths : list of (str or pathlib.Path) or callable or None
+            Dataset file paths; memoized datasets are reloaded if one of these files changes. If
+            callable, it is called with the load options (dict) and returns the file paths, e.g.
+            for datasets whose files depend on a load option.
+        """
+
+        self.loaders[name] = (loader, paths if callable(paths) else list(paths or []))
+
+    def load(self, name, **options):
+        """
+        Load a dataset (or get the memoized dataset).
+
+        Parameters
+        ----------
+        name : str
+            Dataset name.
+        **options
+            Load options passed to the dataset loader.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Dataset (shallow copy: index and columns can be changed, but the values are shared
+            with the memoized dataset and must not be modified in place; memory-mapped values
+            are read-only).
+        """
+
+        try:
+            loader, paths = self.loaders[name]
+        except KeyError:
+            raise KeyError(f"Unknown dataset name. Use one of these: {', '.join(self.names)}.")
+
+        if callable(paths):
+            paths = paths(options)
+        key = (name, tuple(sorted(options.items())), _file_versions(paths))
+
+        if key in self._datasets:
+            logger.debug(f"Use memoized dataset {name}.")
+            self._datasets.move_to_end(key)
+        else:
+            self._datasets[key] = loader(**options)
+            while len(self._datasets) > self.max_size:
+                self._datasets.popitem(last=False)
+
+        # Shallow copy: Callers can relabel or add columns without changing the memoized
+        # dataset, without copying (or reading memory-mapped) values on every load
+        return self._datasets[key].copy(deep=False)
+
+    def clear(self):
+        """
+        Remove all memoized datasets.
+        """
+
+        self._datasets.clear()
+
+
+def _file_versions(paths):
+    """
+    Get resolved path and modification time (None if file does not exist) for each file.
+    """
+
+    versions = []
+    for path in paths:
+        path = Path(path).resolve()
+        mtime = path.stat().st_mtime_ns if path.exists() else None
+        versions.append((str(path), mtime))
+    return tuple(versions)
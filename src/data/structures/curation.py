@@ -0,0 +1,226 @@
+"""
+Curate KLIFS structures incrementally across KLIFS releases.
+
+The curation result of each structure (passed the per-structure filters, selected as best
+structure of its kinase-PDB pair) is stored in a snapshot together with a hash of its structure
+table row. When a new structure table is curated, only added or changed structures are run
+through the per-structure filters and the best structure is only picked again for kinase-PDB
+pairs with added, changed, or removed structures.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .filters import CurationPipeline
+from src.paths import PATH_DATA
+from src.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Increase if the snapshot format changes (invalidates snapshots)
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PATH = PATH_DATA / "interim/curation_snapshot.parquet"
+# Steps that pick structures per group of structures (instead of per structure) and their groups
+GROUP_STEPS = {"select_best_pdb_kinase_pairs": ["kinase.klifs_name", "structure.pdb_id"]}
+
+
+def curate_incremental(structures, pipeline, snapshot_path=SNAPSHOT_PATH, output_path=None):
+    """
+    Curate structures with a curation pipeline, reusing the results of the previous curation
+    (snapshot) for unchanged structures, and save the new snapshot.
+
+    Per-structure filter steps must only depend on the structure table row (or on data that
+    does not change between curations, such as cached KLIFS curation flags). Group steps
+    (`select_best_pdb_kinase_pairs`) must be the last step. If the snapshot is missing or was
+    created with other pipeline steps or other structure table columns, all structures are
+    curated.
+
+    Parameters
+    ----------
+    structures : pandas.DataFrame
+        Structures DataFrame from opencadd.databases.klifs module (unique structure KLIFS IDs).
+    pipeline : src.data.structures.filters.CurationPipeline
+        Curation pipeline.
+    snapshot_path : str or pathlib.Path
+        Path to snapshot Parquet file (read if it exists, then overwritten). Use one snapshot
+        path per curation pipeline, e.g. per DFG conformation.
+    output_path : str or pathlib.Path or None
+        If set, save curated structure KLIFS IDs (sorted, one per line) to this file and the
+        changelog to `<output_path stem>_changelog.csv` next to it.
+
+    Returns
+    -------
+    structures_curated : pandas.DataFrame
+        Curated structures (copy; structures keep their input order).
+    changelog : pandas.DataFrame
+        Change ("added", "removed", "changed", "unchanged") and selection before and after
+        this curation (columns) for all structures whose data or selection changed (rows).
+    """
+
+    structure_klifs_ids = structures["structure.klifs_id"].to_numpy()
+    if not structures["structure.klifs_id"].is_unique:
+        raise ValueError("Structure KLIFS IDs must be unique.")
+
+    # Split pipeline into per-structure steps and a final group step
+    group_step_names = [name for name, _, _ in pipeline.steps if name in GROUP_STEPS]
+    if group_step_names and (
+        len(group_step_names) > 1 or pipeline.steps[-1][0] not in GROUP_STEPS
+    ):
+        raise ValueError("Only one group step is allowed and it must be the last step.")
+    row_pipeline = CurationPipeline(trace_memory=pipeline.trace_memory)
+    row_pipeline.steps = pipeline.steps[:-1] if group_step_names else list(pipeline.steps)
+    group_columns = GROUP_STEPS[group_step_names[0]] if group_step_names else []
+
+    signature = {
+        "version": SNAPSHOT_VERSION,
+        "steps": [[name, _arguments_signature(args)] for name, _, args in pipeline.steps],
+        "columns": [str(column) for column in structures.columns],
+    }
+    snapshot = _read_snapshot(snapshot_path, signature)
+    if snapshot is None:
+        snapshot = structures[group_columns].iloc[slice(0, 0)]
+        snapshot = snapshot.assign(
+            hash=np.array([], dtype=np.uint64),
+            passed=np.array([], dtype=bool),
+            selected=np.array([], dtype=bool),
+        )
+        snapshot.index = pd.Index(structure_klifs_ids[slice(0, 0)], name="structure.klifs_id")
+
+    # Diff structure table against snapshot
+    hashes = pd.util.hash_pandas_object(structures, index=False).to_numpy()
+    # Look up snapshot rows by position (reindexing would cast uint64 hashes to float)
+    snapshot_rows = snapshot.index.get_indexer(structure_klifs_ids)
+    in_snapshot = snapshot_rows >= 0
+    snapshot_hashes = np.append(snapshot["hash"].to_numpy(dtype=np.uint64), np.uint64(0))
+    unchanged = in_snapshot & (snapshot_hashes[snapshot_rows] == hashes)
+    change = np.where(in_snapshot, np.where(unchanged, "unchanged", "changed"), "added")
+    removed_ids = snapshot.index.difference(pd.Index(structure_klifs_ids))
+    logger.info(
+        f"Structures: {(change == 'added').sum()} added, {(change == 'changed').sum()} changed, "
+        f"{len(removed_ids)} removed, {unchanged.sum()} unchanged."
+    )
+
+    # Per-structure steps for added and changed structures only
+    passed = np.zeros(len(structures), dtype=bool)
+    passed[unchanged] = snapshot["passed"].reindex(structure_klifs_ids[unchanged]).to_numpy()
+    check_rows = np.flatnonzero(~unchanged)
+    if len(check_rows) > 0:
+        structures_passed = row_pipeline.run(structures.iloc[check_rows])
+        passed[np.isin(structure_klifs_ids, structures_passed["structure.klifs_id"])] = True
+
+    # Group step for affected groups only
+    if group_step_names:
+        name, mask_function, args = pipeline.steps[-1]
+        groups = pd.MultiIndex.from_frame(structures[group_columns])
+        # Groups of added and changed structures (new groups) and of changed and removed
+        # structures (previous groups)
+        previous_ids = snapshot.index.intersection(
+            pd.Index(structure_klifs_ids[change == "changed"]).append(removed_ids)
+        )
+        previous_groups = pd.MultiIndex.from_frame(snapshot.loc[previous_ids, group_columns])
+        affected_groups = groups[~unchanged].append(previous_groups).unique()
+        affected = groups.isin(affected_groups)
+
+        selected = np.zeros(len(structures), dtype=bool)
+        keep_selection = unchanged & ~affected
+        selected[keep_selection] = (
+            snapshot["selected"].reindex(structure_klifs_ids[keep_selection]).to_numpy()
+        )
+        candidate_rows = np.flatnonzero(passed & affected)
+        selected[candidate_rows[mask_function(structures, candidate_rows, *args)]] = True
+        logger.info(
+            f"{name}: {len(affected_groups)} affected groups, {len(candidate_rows)} candidates."
+        )
+    else:
+        selected = passed
+
+    # Changelog
+    selected_before = snapshot["selected"].reindex(structure_klifs_ids).fillna(False)
+    changelog = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "structure.klifs_id": structure_klifs_ids,
+                    "change": change,
+                    "selected_before": selected_before.to_numpy(dtype=bool),
+                    "selected_after": selected,
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "structure.klifs_id": removed_ids.to_numpy(),
+                    "change": "removed",
+                    "selected_before": snapshot.loc[removed_ids, "selected"].to_numpy(dtype=bool),
+                    "selected_after": False,
+                }
+            ),
+        ]
+    )
+    changed_selection = changelog["selected_before"] != changelog["selected_after"]
+    changelog = changelog[(changelog["change"] != "unchanged") | changed_selection]
+    changelog = changelog.sort_values("structure.klifs_id").reset_index(drop=True)
+
+    # New snapshot
+    new_snapshot = structures[group_columns].assign(hash=hashes, passed=passed, selected=selected)
+    new_snapshot.index = pd.Index(structure_klifs_ids, name="structure.klifs_id")
+    _write_snapshot(new_snapshot, snapshot_path, signature)
+
+    structures_curated = structures.iloc[np.flatnonzero(selected)].copy()
+    if output_path is not None:
+        output_path = Path(output_path)
+        structures_curated["structure.klifs_id"].sort_values().to_csv(
+            output_path, index=None, header=None
+        )
+        changelog.to_csv(output_path.with_name(f"{output_path.stem}_changelog.csv"), index=False)
+
+    return structures_curated, changelog
+
+
+def _arguments_signature(args):
+    """
+    Get JSON-serializable signature of step arguments (objects by their type name).
+    """
+
+    return json.loads(json.dumps(args, default=lambda obj: type(obj).__name__))
+
+
+def _manifest_path(snapshot_path):
+    """
+    Get path to the snapshot manifest.
+    """
+
+    return Path(snapshot_path).with_suffix(".json")
+
+
+def _read_snapshot(snapshot_path, signature):
+    """
+    Read snapshot if it exists and was created with the same signature, else return None.
+    """
+
+    snapshot_path = Path(snapshot_path)
+    manifest_path = _manifest_path(snapshot_path)
+    if not (snapshot_path.exists() and manifest_path.exists()):
+        logger.info("No curation snapshot available: Curate all structures.")
+        return None
+    with open(manifest_path, "r") as f:
+        if json.load(f) != signature:
+            logger.info("Curation snapshot is outdated: Curate all structures.")
+            return None
+    return pd.read_parquet(snapshot_path)
+
+
+def _write_snapshot(snapshot, snapshot_path, signature):
+    """
+    Write snapshot and its manifest.
+    """
+
+    manifest_path = _manifest_path(snapshot_path)
+    # Remove manifest first: a snapshot is only read if its manifest exists
+    if manifest_path.exists():
+        manifest_path.unlink()
+    atomic_write(snapshot_path, snapshot.to_parquet)
+    atomic_write(manifest_path, lambda path: path.write_text(json.dumps(signature)))
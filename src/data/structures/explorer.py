@@ -3,8 +3,9 @@ Explores the KLIFS dataset with common plotting functionalities.
 """
 
 import matplotlib.pyplot as plt
-import pandas as pd
-from opencadd.databases.klifs import setup_remote
+
+from src.data.klifs_cache import setup_remote
+from src.data.pockets import PocketMatrix
 
 SMALL_SIZE = 12
 MEDIUM_SIZE = 14
@@ -155,7 +156,7 @@ def plot_number_of_kinases_per_kinase_group(structures, remote=None):
     structures : pandas.DataFrame
         Structures DataFrame from opencadd.databases.klifs module.
     remote : None or opencadd.databases.klifs.session.Session
-        Remote KLIFS session. If None, generate new remote session.
+        Remote KLIFS session. If None, generate new (cached) remote session.
 
     Returns
     -------
@@ -181,7 +182,7 @@ def plot_number_of_kinases_per_kinase_group(structures, remote=None):
     return fig, ax
 
 
-def plot_missing_residues(structures, remote=None, anchor_residues=None):
+def plot_missing_residues(structures, remote=None, anchor_residues=None, pocket_matrix=None):
     """
     Plot number of missing residues for each binding site residue.
 
@@ -190,11 +191,14 @@ def plot_missing_residues(structures, remote=None, anchor_residues=None):
     structures : pandas.DataFrame
         Structures DataFrame from opencadd.databases.klifs module.
     remote : None or opencadd.databases.klifs.session.Session
-        Remote KLIFS session. If None, generate new remote session.
+        Remote KLIFS session. If None, generate new (cached) remote session.
     anchor_residues : None or dict (str: list of int)
         Dictionary of anchor residues (values: list of residue KLIFS IDs) for one or more
         subpockets (keys: subpocket name). If not none, asterisks is placed over anchor residue
         bars.
+    pocket_matrix : None or src.data.pockets.PocketMatrix
+        Pocket matrix of `structures` (see `PocketMatrix.from_structures`), e.g. to share it
+        between plots. If None, build it from `structures`.
 
     Returns
     -------
@@ -203,7 +207,9 @@ def plot_missing_residues(structures, remote=None, anchor_residues=None):
     """
 
     # Get missing residues
-    missing_residues = _get_missing_residues(structures)
+    if pocket_matrix is None:
+        pocket_matrix = PocketMatrix.from_structures(structures)
+    missing_residues = pocket_matrix.missing_residues()
     # Get KLIFS colors (remotely for example structure)
     klifs_colors = _get_klifs_residue_colors(remote)
 
@@ -222,7 +228,7 @@ def plot_missing_residues(structures, remote=None, anchor_residues=None):
     return fig, ax
 
 
-def plot_missing_subpockets(structures, anchor_residues):
+def plot_missing_subpockets(structures, anchor_residues, pocket_matrix=None):
     """
     Plot number of missing subpockets.
 
@@ -233,18 +239,19 @@ def plot_missing_subpockets(structures, anchor_residues):
     anchor_residues : dict (str: list of int)
         Dictionary of anchor residues (values: list of residue KLIFS IDs) for one or more
         subpockets (keys: subpocket name).
+    pocket_matrix : None or src.data.pockets.PocketMatrix
+        Pocket matrix of `structures` (see `PocketMatrix.from_structures`), e.g. to share it
+        between plots. If None, build it from `structures`.
 
     Returns
     -------
     matplotlib.pyplot.axis
         Plot axis.
     """
-    # Get missing residues
-    missing_residues = _get_missing_residues(structures)
     # Get missing subpockets
-    missing_subpockets = pd.Series(
-        {key: missing_residues[value].sum() for key, value in anchor_residues.items()}
-    )
+    if pocket_matrix is None:
+        pocket_matrix = PocketMatrix.from_structures(structures)
+    missing_subpockets = pocket_matrix.missing_subpockets(anchor_residues)
     # Plot missing subpockets
     missing_subpockets_stats = round(
         missing_subpockets.sort_values(ascending=False) / len(structures) * 100, 2
@@ -257,7 +264,7 @@ def plot_missing_subpockets(structures, anchor_residues):
     return fig, ax
 
 
-def plot_modified_residues(structures, remote=None, anchor_residues=None):
+def plot_modified_residues(structures, remote=None, anchor_residues=None, pocket_matrix=None):
     """
     Plot number of modified residues ("X") for each binding site residue.
 
@@ -266,73 +273,35 @@ def plot_modified_residues(structures, remote=None, anchor_residues=None):
     structures : pandas.DataFrame
         Structures DataFrame from opencadd.databases.klifs module.
     remote : None or opencadd.databases.klifs.session.Session
-        Remote KLIFS session. If None, generate new remote session.
+        Remote KLIFS session. If None, generate new (cached) remote session.
     anchor_residues : None or dict (str: list of int)
         Dictionary of anchor residues (values: list of residue KLIFS IDs) for one or more
         subpockets (keys: subpocket name). If not none, asterisks is placed over anchor residue
         bars.
+    pocket_matrix : None or src.data.pockets.PocketMatrix
+        Pocket matrix of `structures` (see `PocketMatrix.from_structures`), e.g. to share it
+        between plots. If None, build it from `structures`.
 
     Returns
     -------
     matplotlib.pyplot.axis
         Plot axis.
     """
-    # Format pocket residues
-    pockets = _get_pockets(structures)
+    # Get modified residues
+    if pocket_matrix is None:
+        pocket_matrix = PocketMatrix.from_structures(structures)
+    modified_residues = pocket_matrix.modified_residues()
     # Get KLIFS colors (remotely for example structure)
     klifs_colors = _get_klifs_residue_colors(remote)
 
     fig, ax = plt.subplots(1, 1)
-    (
-        pockets.apply(lambda x: x == "X")
-        .sum()
-        .plot(kind="bar", figsize=(20, 5), xlabel="KLIFS residue ID", color=klifs_colors, ax=ax)
+    modified_residues.plot(
+        kind="bar", figsize=(20, 5), xlabel="KLIFS residue ID", color=klifs_colors, ax=ax
     )
     ax = _label_anchor_residues(ax, anchor_residues)
     return fig, ax
 
 
-def _get_pockets(structures):
-    """
-    Get pocket residue sequence for all structures.
-
-    Parameters
-    ----------
-    structures : pandas.DataFrame
-        Structures DataFrame from opencadd.databases.klifs module.
-
-    Returns
-    -------
-    pandas.DataFrame
-        Residue names as one-letter amino acid code for all residues 1-85 in the pocket (columns)
-        for all input structures (rows).
-    """
-    pockets = pd.DataFrame(
-        structures["structure.pocket"].apply(list).to_list(), columns=range(1, 86)
-    )
-    return pockets
-
-
-def _get_missing_residues(structures):
-    """
-    Across all input structures, get number of missing residues per pocket residue position (1-85).
-
-    Parameters
-    ----------
-    structures : pandas.DataFrame
-        Structures DataFrame from opencadd.databases.klifs module.
-
-    Returns
-    -------
-    pd.Series
-        Number of missing residues (values) for all pocket residue positions 1-85 (index).
-    """
-
-    pockets = _get_pockets(structures)
-    missing_residues = pockets.apply(lambda x: x == "_").sum()
-    return missing_residues
-
-
 def _get_klifs_residue_colors(remote=None):
     """
     Get KLIFS residue colors from example structure KLIFS ID (12347).
@@ -340,7 +309,7 @@ def _get_klifs_residue_colors(remote=None):
     Parameters
     ----------
     remote : None or opencadd.databases.klifs.session.Session
-        Remote KLIFS session. If None, generate new remote session.
+        Remote KLIFS session. If None, generate new (cached) remote session.
 
     Returns
     -------
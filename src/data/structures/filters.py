@@ -1,29 +1,218 @@
 """
 Defines filters for the KLIFS dataset.
+
+Filters can be applied one after another (`select_*` functions, each returns a filtered
+DataFrame) or composed in a `CurationPipeline` (all filters are evaluated as masks over the
+input DataFrame in one pass).
 """
 
 from functools import wraps
-import datetime
 import logging
+import time
+import tracemalloc
 
+import numpy as np
 import pandas as pd
 
+from src.data.klifs_flags import FlagService
+from src.data.pockets import pocket_mutations
+
 logger = logging.getLogger(__name__)
 
 
 def log_step(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = datetime.datetime.now()
+        start_time = time.perf_counter()
         result = func(*args, **kwargs)
-        end_time = datetime.datetime.now()
-        time_taken = str(start_time - end_time)
-        logger.info(f"{func.__name__:<30}{result.shape[0]:>7} structures ({time_taken}s)")
+        time_taken = time.perf_counter() - start_time
+        logger.info(f"{func.__name__:<30}{result.shape[0]:>7} structures ({time_taken:.3f}s)")
         return result
 
     return wrapper
 
 
+class CurationPipeline:
+    """
+    Structure curation pipeline that composes filters lazily: Filters are only collected when
+    added and evaluated when the pipeline is run. Each filter is evaluated as boolean mask over
+    the structures kept by the previous filters (no intermediate DataFrame copies) and only the
+    final selection is copied.
+
+    Example:
+    >>> pipeline = (
+    ...     CurationPipeline()
+    ...     .select_species("Human")
+    ...     .select_resolution(4)
+    ...     .select_maximum_n_mutations(3)
+    ...     .select_best_pdb_kinase_pairs()
+    ... )
+    >>> structures_filtered = pipeline.run(structures)
+    >>> pipeline.report
+
+    Attributes
+    ----------
+    steps : list of tuple
+        Step name, mask function, and mask function arguments for each step.
+    trace_memory : bool
+        Trace memory allocations per step with `tracemalloc` (default: False). Each step is
+        then evaluated a second time under tracing, so that tracing does not distort its time.
+    report : pandas.DataFrame or None
+        Number of input structures, number of kept structures, wall time in seconds, net memory
+        allocated (bytes), and peak memory allocated (bytes) (columns) for each step (rows) of
+        the last run. Memory is NaN if not traced.
+    """
+
+    def __init__(self, trace_memory=False):
+
+        self.steps = []
+        self.trace_memory = trace_memory
+        self.report = None
+
+    def add(self, name, mask_function, *args):
+        """
+        Add a filter step.
+
+        Parameters
+        ----------
+        name : str
+            Step name.
+        mask_function : callable
+            Function that takes the structures DataFrame, the positions of the structures to be
+            checked (numpy.ndarray), and `args` and returns a boolean mask (True: keep) for
+            these structures.
+        *args
+            Arguments passed to the mask function.
+
+        Returns
+        -------
+        src.data.structures.filters.CurationPipeline
+            Pipeline (to chain steps).
+        """
+
+        self.steps.append((name, mask_function, args))
+        return self
+
+    def select_species(self, species):
+        """
+        Add `select_species` step.
+        """
+        return self.add("select_species", _species_mask, species)
+
+    def select_dfg(self, dfg_conformation):
+        """
+        Add `select_dfg` step.
+        """
+        return self.add("select_dfg", _dfg_mask, dfg_conformation)
+
+    def select_resolution(self, resolution_max):
+        """
+        Add `select_resolution` step.
+        """
+        return self.add("select_resolution", _resolution_mask, resolution_max)
+
+    def select_qualityscore(self, qualityscore_min):
+        """
+        Add `select_qualityscore` step.
+        """
+        return self.add("select_qualityscore", _qualityscore_mask, qualityscore_min)
+
+    def select_maximum_n_mutations(self, n_mutations):
+        """
+        Add `select_maximum_n_mutations` step.
+        """
+        return self.add("select_maximum_n_mutations", _maximum_n_mutations_mask, n_mutations)
+
+    def select_maximum_n_missing_residues(self, n_missing_residues):
+        """
+        Add `select_maximum_n_missing_residues` step.
+        """
+        return self.add(
+            "select_maximum_n_missing_residues",
+            _maximum_n_missing_residues_mask,
+            n_missing_residues,
+        )
+
+    def select_best_pdb_kinase_pairs(self):
+        """
+        Add `select_best_pdb_kinase_pairs` step.
+        """
+        return self.add("select_best_pdb_kinase_pairs", _best_pdb_kinase_pairs_mask)
+
+    def select_unflagged_structures_only(self, flag_service=None):
+        """
+        Add `select_unflagged_structures_only` step.
+        """
+        return self.add(
+            "select_unflagged_structures_only", _unflagged_structures_mask, flag_service
+        )
+
+    def run(self, structures):
+        """
+        Run all filter steps and record time, kept structures, and memory per step in `report`.
+
+        Parameters
+        ----------
+        structures : pandas.DataFrame
+            Structures DataFrame from opencadd.databases.klifs module.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Filtered DataFrame (copy; structures keep their input order).
+        """
+
+        rows = np.arange(len(structures))
+        report = []
+        for name, mask_function, args in self.steps:
+            n_structures = len(rows)
+            start_time = time.perf_counter()
+            mask = np.asarray(mask_function(structures, rows, *args), dtype=bool)
+            time_taken = time.perf_counter() - start_time
+
+            if self.trace_memory:
+                memory_delta, memory_peak = _traced_memory(mask_function, structures, rows, args)
+            else:
+                memory_delta = memory_peak = np.nan
+            rows = rows[mask]
+
+            logger.info(f"{name:<30}{len(rows):>7} structures ({time_taken:.3f}s)")
+            report.append([name, n_structures, len(rows), time_taken, memory_delta, memory_peak])
+
+        self.report = pd.DataFrame(
+            report,
+            columns=[
+                "step",
+                "n_structures",
+                "n_structures_kept",
+                "seconds",
+                "memory_delta",
+                "memory_peak",
+            ],
+        ).set_index("step")
+        return structures.iloc[rows].copy()
+
+
+def _traced_memory(mask_function, structures, rows, args):
+    """
+    Evaluate a mask function under `tracemalloc` and get the net and peak memory allocated
+    (bytes). The peak is NaN if memory is already traced outside of this evaluation (peak not
+    specific to this evaluation).
+    """
+
+    start_tracing = not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    # Keep the mask referenced until measured (counted as allocated by this evaluation)
+    mask = mask_function(structures, rows, *args)  # noqa: F841
+    memory_end, memory_peak = tracemalloc.get_traced_memory()
+    if start_tracing:
+        tracemalloc.stop()
+    memory_peak = memory_peak - memory_start if start_tracing else np.nan
+    return memory_end - memory_start, memory_peak
+
+
 @log_step
 def make_copy(dataframe):
     """
@@ -59,9 +248,7 @@ def select_species(structures, species):
     pandas.DataFrame
         Filtered DataFrame.
     """
-    if not isinstance(species, list):
-        species = [species]
-    return structures[structures["species.klifs"].isin(species)]
+    return structures[_species_mask(structures, _all_rows(structures), species)]
 
 
 @log_step
@@ -81,9 +268,7 @@ def select_dfg(structures, dfg_conformation):
     pandas.DataFrame
         Filtered DataFrame.
     """
-    if not isinstance(dfg_conformation, list):
-        dfg_conformation = [dfg_conformation]
-    return structures[structures["structure.dfg"].isin(dfg_conformation)]
+    return structures[_dfg_mask(structures, _all_rows(structures), dfg_conformation)]
 
 
 @log_step
@@ -103,7 +288,7 @@ def select_resolution(structures, resolution_max):
     pandas.DataFrame
         Filtered DataFrame.
     """
-    return structures[structures["structure.resolution"] <= resolution_max]
+    return structures[_resolution_mask(structures, _all_rows(structures), resolution_max)]
 
 
 @log_step
@@ -123,7 +308,7 @@ def select_qualityscore(structures, qualityscore_min):
     pandas.DataFrame
         Filtered DataFrame.
     """
-    return structures[structures["structure.qualityscore"] >= qualityscore_min]
+    return structures[_qualityscore_mask(structures, _all_rows(structures), qualityscore_min)]
 
 
 @log_step
@@ -145,54 +330,7 @@ def select_maximum_n_mutations(structures, n_mutations):
         Filtered DataFrame.
     """
 
-    def has_more_than_n_mutations(structure_seq, kinase_seq, n_mutations):
-        """
-        Check if input KLIFS structures has a mutation by comparing the KLIFS structure pocket
-        sequence to the KLIFS kinase pocket sequence. "_" and "-" residues are omitted, any other
-        positional mismatches are reported as mutation.
-
-        Parameters
-        ----------
-        structure_seq : str
-            KLIFS structure pocket sequence. Same length as `kinase_seq`.
-        kinase_seq : str
-            KLIFS kinase pocket sequence. Same length as `structure_seq`.
-        n_mutations : int
-            Number of mutations allowed.
-
-        Returns
-        -------
-        bool
-            Structure has a mutation (True) or not (False).
-        """
-
-        sequences = pd.DataFrame(
-            [list(structure_seq), list(kinase_seq)], index=["structure", "kinase"]
-        ).transpose()
-        sequences.index = sequences.index + 1
-        # Remove gaps in KLIFS structure, which are denoted with "_"
-        sequences = sequences[sequences.apply(lambda x: x["structure"] != "_", axis=1)]
-        # Remove gaps in KLIFS kinase, which are denoted with "-"
-        sequences = sequences[sequences.apply(lambda x: x["kinase"] != "-", axis=1)]
-
-        # Get mutations by detecting positional mismatches
-        mutations = sequences[sequences.apply(lambda x: x["structure"] != x["kinase"], axis=1)]
-
-        if mutations.shape[0] > n_mutations:
-            return True
-        else:
-            return False
-
-    # Keep only structures without any mutations
-    structures = structures[
-        structures.apply(
-            lambda x: not has_more_than_n_mutations(
-                x["structure.pocket"], x["kinase.pocket"], n_mutations
-            ),
-            axis=1,
-        )
-    ]
-    return structures
+    return structures[_maximum_n_mutations_mask(structures, _all_rows(structures), n_mutations)]
 
 
 @log_step
@@ -212,7 +350,9 @@ def select_maximum_n_missing_residues(structures, n_missing_residues):
     pandas.DataFrame
         Filtered DataFrame.
     """
-    return structures[structures["structure.pocket"].str.count("_") <= n_missing_residues]
+    return structures[
+        _maximum_n_missing_residues_mask(structures, _all_rows(structures), n_missing_residues)
+    ]
 
 
 @log_step
@@ -285,7 +425,7 @@ def select_best_pdb_kinase_pairs(structures):
 
 
 @log_step
-def select_unflagged_structures_only(structures):
+def select_unflagged_structures_only(structures, flag_service=None):
     """
     Remove structures that are flagged in KLIFS.
 
@@ -293,33 +433,103 @@ def select_unflagged_structures_only(structures):
     ----------
     structures : pandas.DataFrame
         Structures DataFrame from opencadd.databases.klifs module.
+    flag_service : src.data.klifs_flags.FlagService or None
+        Service to look up (cached) KLIFS curation flags. If None, use a service with default
+        settings (KLIFS release, API URL, and offline mode from environment variables).
 
     Returns
     -------
     pandas.DataFrame
         Filtered DataFrame.
     """
-    # TODO: This bit will be part of opencadd at some point
-    from bravado.client import SwaggerClient
+    return structures[_unflagged_structures_mask(structures, _all_rows(structures), flag_service)]
 
-    KLIFS_API_DEFINITIONS = "https://klifs.net/swagger_v2/swagger.json"
-    KLIFS_CLIENT = SwaggerClient.from_url(
-        KLIFS_API_DEFINITIONS, config={"validate_responses": False}
-    )
-    structures_list = (
-        KLIFS_CLIENT.Structures.get_structure_list(
-            structure_ID=structures["structure.klifs_id"].to_list()
-        )
-        .response()
-        .result
+
+def _all_rows(structures):
+    """
+    Get positions of all structures.
+    """
+    return np.arange(len(structures))
+
+
+def _species_mask(structures, rows, species):
+    """
+    Mask for `select_species`.
+    """
+    if not isinstance(species, list):
+        species = [species]
+    return structures["species.klifs"].iloc[rows].isin(species).to_numpy()
+
+
+def _dfg_mask(structures, rows, dfg_conformation):
+    """
+    Mask for `select_dfg`.
+    """
+    if not isinstance(dfg_conformation, list):
+        dfg_conformation = [dfg_conformation]
+    return structures["structure.dfg"].iloc[rows].isin(dfg_conformation).to_numpy()
+
+
+def _resolution_mask(structures, rows, resolution_max):
+    """
+    Mask for `select_resolution`.
+    """
+    return (structures["structure.resolution"].iloc[rows] <= resolution_max).to_numpy()
+
+
+def _qualityscore_mask(structures, rows, qualityscore_min):
+    """
+    Mask for `select_qualityscore`.
+    """
+    return (structures["structure.qualityscore"].iloc[rows] >= qualityscore_min).to_numpy()
+
+
+def _maximum_n_mutations_mask(structures, rows, n_mutations):
+    """
+    Mask for `select_maximum_n_mutations`.
+    """
+    mutations = pocket_mutations(
+        structures["structure.pocket"].iloc[rows], structures["kinase.pocket"].iloc[rows]
     )
+    return mutations.sum(axis=1) <= n_mutations
 
-    flagged_structure_klifs_ids = []
-    for structure in structures_list:
-        if structure.curation_flag:
-            flagged_structure_klifs_ids.append(structure.structure_ID)
 
-    # Remove flagged structures from kissim dataset
-    structures = structures[~structures["structure.klifs_id"].isin(flagged_structure_klifs_ids)]
+def _maximum_n_missing_residues_mask(structures, rows, n_missing_residues):
+    """
+    Mask for `select_maximum_n_missing_residues`.
+    """
+    n_missing = structures["structure.pocket"].iloc[rows].str.count("_")
+    return (n_missing <= n_missing_residues).to_numpy()
 
-    return structures
+
+def _best_pdb_kinase_pairs_mask(structures, rows):
+    """
+    Mask for `select_best_pdb_kinase_pairs`.
+    """
+    columns = [
+        "kinase.klifs_name",
+        "structure.pdb_id",
+        "structure.missing_residues",
+        "structure.missing_atoms",
+        "structure.alternate_model",
+        "structure.chain",
+    ]
+    structures = structures[columns].iloc[rows].reset_index(drop=True)
+    structures = structures.sort_values(by=columns, kind="mergesort")
+    best = ~structures.duplicated(subset=["kinase.klifs_name", "structure.pdb_id"], keep="first")
+    mask = np.zeros(len(rows), dtype=bool)
+    mask[structures.index[best]] = True
+    return mask
+
+
+def _unflagged_structures_mask(structures, rows, flag_service=None):
+    """
+    Mask for `select_unflagged_structures_only`.
+    """
+    if flag_service is None:
+        flag_service = FlagService()
+    structure_klifs_ids = structures["structure.klifs_id"].iloc[rows]
+    flagged_structure_klifs_ids = flag_service.flagged(structure_klifs_ids.to_list())
+
+    # Remove flagged structures from kissim dataset
+    return ~structure_klifs_ids.isin(flagged_structure_klifs_ids).to_numpy()
@@ -35,7 +35,7 @@ def pkidb(ligand_names, fda_approved=False):
     if isinstance(ligand_names, str):
         ligand_names = [ligand_names]
 
-    pkidb_df = ligands.pkidb(fda_approved=fda_approved)
+    pkidb_df = ligands.pkidb(fda_approved=fda_approved, molecules=False)
 
     # Get targets (listed in PKIDB) for each of the input ligands
     ligand_target_sets = [_pkidb(ligand_name, pkidb_df) for ligand_name in ligand_names]
@@ -2,13 +2,14 @@
 Data container for ligand-kinase data.
 """
 
+from collections import defaultdict
 import logging
 
+import numpy as np
 import pandas as pd
 
 from src.evaluation.data.base_data import BaseData
 
-
 logger = logging.getLogger(__name__)
 
 
@@ -96,6 +97,174 @@ class LigandVsKinaseData(BaseData):
             kinase_activity_max,
         )
 
+    @classmethod
+    def batch(
+        cls,
+        ligand_kinase_pairs,
+        ligand_kinase_method,
+        kinase_kinase_method,
+        ligand_kinase_matrix,
+        kinase_kinase_matrix,
+        kinase_activity_cutoff,
+        kinase_activity_max,
+    ):
+        """
+        Initiate datasets for multiple ligand-kinase pairs at once.
+
+        Both matrices are aligned once on the kinase-kinase matrix kinases; measures, activity
+        masks, and ranks are calculated for all pairs at once. Results are the same as
+        initiating each pair separately. Pairs that cannot be initiated (see `__init__`) are
+        logged and skipped.
+
+        Parameters
+        ----------
+        ligand_kinase_pairs : list of list of str
+            List of ligand-kinase pairs.
+        ligand_kinase_method : str
+            Name for ligand profiling method to be used as identifier.
+        kinase_kinase_method : str
+            Name for kinase distances method to be used as identifier.
+        ligand_kinase_matrix : pandas.DataFrame
+            Ligand-kinase activity matrix.
+        kinase_kinase_matrix : pandas.DataFrame
+            Kinase-kinase distance matrix.
+        kinase_activity_cutoff : float
+            Cutoff value to be used to determine activity. By default this cutoff is the maximum
+            value. Set `kinase_activity_max=False` if cutoff is the minimum value.
+        kinase_activity_max : bool
+            If `True` (default), the `kinase_activity_cutoff` is used as the maximum cutoff, else
+            as the minimum cutoff.
+
+        Returns
+        -------
+        dict of dict of LigandVsKinaseData
+            For each ligand (key 1) and each kinase (key 2) the respective dataset.
+        """
+
+        data_dict = defaultdict(dict)
+
+        # Duplicated kinase names cannot be aligned; initiate each pair separately
+        if not (kinase_kinase_matrix.index.is_unique and ligand_kinase_matrix.index.is_unique):
+            for ligand_name, kinase_name in ligand_kinase_pairs:
+                try:
+                    data_dict[ligand_name][kinase_name] = cls(
+                        ligand_name,
+                        kinase_name,
+                        ligand_kinase_method,
+                        kinase_kinase_method,
+                        ligand_kinase_matrix,
+                        kinase_kinase_matrix,
+                        kinase_activity_cutoff,
+                        kinase_activity_max,
+                    )
+                except KeyError as e:
+                    logger.error(e)
+            return data_dict
+
+        # Keep only pairs whose query kinase and query ligand are part of the matrices
+        pairs = []
+        for ligand_name, kinase_name in ligand_kinase_pairs:
+            if kinase_name not in kinase_kinase_matrix.columns:
+                logger.error(
+                    KeyError(f"Query kinase {kinase_name} is not part of kinase-kinase matrix.")
+                )
+            elif ligand_name not in ligand_kinase_matrix.columns:
+                logger.error(
+                    KeyError(f"Query ligand {ligand_name} is not part of kinase-ligand matrix.")
+                )
+            else:
+                pairs.append((ligand_name, kinase_name))
+        if len(pairs) == 0:
+            return data_dict
+        ligand_names = [ligand_name for ligand_name, _ in pairs]
+        kinase_names = [kinase_name for _, kinase_name in pairs]
+
+        # Kinase (rows) data for each pair (columns), aligned on kinase-kinase matrix kinases
+        kinases = kinase_kinase_matrix.index
+        kk_measures = kinase_kinase_matrix[kinase_names].to_numpy(dtype=np.float64)
+        lk_measures = ligand_kinase_matrix[ligand_names]
+        n_kinases_by_ligand = lk_measures.notna().sum().to_numpy()
+        lk_ranks1 = lk_measures.rank().reindex(kinases).to_numpy()
+        lk_measures = lk_measures.reindex(kinases).to_numpy(dtype=np.float64)
+
+        shared = ~np.isnan(kk_measures) & ~np.isnan(lk_measures)
+        kk_ranks1 = _rank(kk_measures)
+        kk_ranks2 = _rank(np.where(shared, kk_measures, np.nan))
+        lk_ranks2 = _rank(np.where(shared, lk_measures, np.nan))
+        with np.errstate(invalid="ignore"):
+            if kinase_activity_max:
+                active = lk_measures <= kinase_activity_cutoff
+            else:
+                active = lk_measures >= kinase_activity_cutoff
+
+        n_kinases_by_kinase = (~np.isnan(kk_measures)).sum(axis=0)
+        n_kinases_shared = shared.sum(axis=0)
+        n_active_kinases_shared = (shared & active).sum(axis=0)
+
+        # Query kinase must be a shared and active kinase
+        query_rows = kinases.get_indexer(kinase_names)
+        query_shared = (query_rows >= 0) & shared[query_rows, np.arange(len(pairs))]
+        query_active = query_shared & active[query_rows, np.arange(len(pairs))]
+
+        columns = [
+            f"{ligand_kinase_method}.measure",
+            f"{ligand_kinase_method}.active",
+            f"{ligand_kinase_method}.rank1",
+            f"{ligand_kinase_method}.rank2",
+            f"{kinase_kinase_method}.measure",
+            f"{kinase_kinase_method}.rank1",
+            f"{kinase_kinase_method}.rank2",
+        ]
+        arrays = [
+            lk_measures,
+            active,
+            lk_ranks1,
+            lk_ranks2,
+            kk_measures,
+            kk_ranks1,
+            kk_ranks2,
+        ]
+
+        for i, (ligand_name, kinase_name) in enumerate(pairs):
+            if not query_shared[i]:
+                logger.error(
+                    KeyError(
+                        f"{kinase_name} is not part of the ligand profiling dataset "
+                        f"for {ligand_name}"
+                    )
+                )
+                continue
+            if not query_active[i]:
+                logger.error(
+                    KeyError(
+                        f"{kinase_name} is not an active kinase in the ligand profiling dataset "
+                        f"for {ligand_name}"
+                    )
+                )
+                continue
+
+            rows = shared[:, i]
+            kinase_data = pd.DataFrame(
+                {column: array[rows, i] for column, array in zip(columns, arrays)},
+                index=pd.Index(kinases[rows], name="kinase"),
+            )
+            # Sort rows by kinase-kinase method (DO NOT CHANGE!)
+            kinase_data = kinase_data.sort_values(f"{kinase_kinase_method}.measure")
+
+            data = cls.__new__(cls)
+            data.ligand_query = ligand_name
+            data.kinase_query = kinase_name
+            data.ligand_kinase_method = ligand_kinase_method
+            data.kinase_kinase_method = kinase_kinase_method
+            data.data = kinase_data
+            data.n_kinases_by_kinase = int(n_kinases_by_kinase[i])
+            data.n_kinases_by_ligand = int(n_kinases_by_ligand[i])
+            data.n_kinases_shared = int(n_kinases_shared[i])
+            data.n_active_kinases_shared = int(n_active_kinases_shared[i])
+            data_dict[ligand_name][kinase_name] = data
+
+        return data_dict
+
     def _merge_datasets(
         self,
         ligand_kinase_matrix,
@@ -254,3 +423,12 @@ class LigandVsKinaseData(BaseData):
             return kinase_data
         except KeyError:
             raise KeyError(f"Query ligand {ligand_query} is not part of kinase-ligand matrix.")
+
+
+def _rank(measures):
+    """
+    Rank measures per column (same as `pandas.Series.rank`: average ranks, NaN values are not
+    ranked).
+    """
+
+    return pd.DataFrame(measures).rank().to_numpy()
@@ -3,11 +3,17 @@ Evaluate method performance based on ligand-kinase data.
 """
 
 from collections import defaultdict
+import json
 import logging
 import math
+import multiprocessing
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 from src import data
 from src.evaluation import utils
@@ -16,6 +22,9 @@ from src.evaluation.data.ligand_vs_kinase_data import LigandVsKinaseData
 logger = logging.getLogger(__name__)
 plt.style.use("seaborn")
 
+# Plot types that can be exported with `LigandVsKinaseEvaluator.export_plots`
+EXPORT_PLOTS = ["enrichment", "enrichment_factors", "roc_curves"]
+
 
 class LigandVsKinaseEvaluator:
     """
@@ -50,6 +59,8 @@ class LigandVsKinaseEvaluator:
         fda_approved=False,
         kinmap_kinases=True,
         kinase_kinase_path=None,
+        ligand_kinase_matrix=None,
+        kinase_kinase_matrix=None,
     ):
         """
         Initialize LigandVsKinaseEvaluator.
@@ -80,6 +91,14 @@ class LigandVsKinaseEvaluator:
         kinase_kinase_path : str or pathlib.Path or None
             Set path to user-defined dataset file. If None, use default path for respective
             dataset.
+        ligand_kinase_matrix : pd.DataFrame or None
+            Use this ligand-kinase matrix instead of loading the `ligand_kinase_method` dataset
+            (`pkidb_ligands`, `fda_approved`, and `kinmap_kinases` are ignored). Must be given
+            together with `kinase_kinase_matrix`.
+        kinase_kinase_matrix : pd.DataFrame or None
+            Use this kinase-kinase matrix instead of loading the `kinase_kinase_method` dataset
+            (`kinmap_kinases` and `kinase_kinase_path` are ignored). Must be given together with
+            `ligand_kinase_matrix`.
         """
 
         self.ligand_kinase_method = ligand_kinase_method
@@ -89,33 +108,30 @@ class LigandVsKinaseEvaluator:
         self.data_dict = None
 
         # Get ligand-kinase and kinase-kinase matrices
-        ligand_kinase_matrix, kinase_kinase_matrix = self._load_datasets(
-            ligand_kinase_method,
-            kinase_kinase_method,
-            pkidb_ligands,
-            fda_approved,
-            kinmap_kinases,
-            kinase_kinase_path,
-        )
+        if (ligand_kinase_matrix is None) != (kinase_kinase_matrix is None):
+            raise ValueError(
+                "Set both or none of `ligand_kinase_matrix` and `kinase_kinase_matrix`."
+            )
+        if ligand_kinase_matrix is None:
+            ligand_kinase_matrix, kinase_kinase_matrix = self._load_datasets(
+                ligand_kinase_method,
+                kinase_kinase_method,
+                pkidb_ligands,
+                fda_approved,
+                kinmap_kinases,
+                kinase_kinase_path,
+            )
 
         # Get merged dataset for each ligand-kinase pair
-        data_dict = defaultdict(dict)
-        for ligand_name, kinase_name in self.ligand_kinase_pairs:
-            try:
-                data = LigandVsKinaseData(
-                    ligand_name,
-                    kinase_name,
-                    self.ligand_kinase_method,
-                    self.kinase_kinase_method,
-                    ligand_kinase_matrix,
-                    kinase_kinase_matrix,
-                    kinase_activity_cutoff,
-                    kinase_activity_max,
-                )
-                data_dict[ligand_name][kinase_name] = data
-            except KeyError as e:
-                logging.error(e)
-        self.data_dict = data_dict
+        self.data_dict = LigandVsKinaseData.batch(
+            self.ligand_kinase_pairs,
+            self.ligand_kinase_method,
+            self.kinase_kinase_method,
+            ligand_kinase_matrix,
+            kinase_kinase_matrix,
+            kinase_activity_cutoff,
+            kinase_activity_max,
+        )
 
         # Curate input ligand kinase pairs
         self.ligand_kinase_pairs_curated = self._curate_ligand_kinase_pairs(
@@ -216,30 +232,8 @@ class LigandVsKinaseEvaluator:
         _, axes = plt.subplots(figsize=(n_cols * 5, n_rows * 5), nrows=n_rows, ncols=n_cols)
         axes = axes.reshape(-1)
 
-        for i, (ligand_name, (experiment_df, optimum, n_kinases, n_active_kinases)) in enumerate(
-            enrichment_plots_data_dict.items()
-        ):
-            # Experimental curves
-            experiment_df.plot(
-                title=(
-                    f"{ligand_name.upper()} (in total {n_kinases} kinases, "
-                    f"{n_active_kinases} active kinases)"
-                ),
-                ylim=(0, 101),
-                xlim=(-1, 100),
-                ax=axes[i],
-            )
-            # Optimal curve
-            axes[i].plot(
-                [0, optimum, 100], [0, 100, 100], label="Optimum", linestyle="--", color="k"
-            )
-            # Random curve
-            axes[i].plot([0, 100], [0, 100], label="Random", linestyle="--", color="grey")
-            axes[i].legend()
-            # Cosmetics
-            axes[i].set_aspect(1.0 / axes[i].get_data_ratio(), adjustable="box")
-            axes[i].set_xlabel("% ranked kissim dataset")
-            axes[i].set_ylabel("% true active kinases identified")
+        for i, (ligand_name, ligand_data) in enumerate(enrichment_plots_data_dict.items()):
+            _plot_enrichment_panel(axes[i], ligand_name, ligand_data)
 
         # Make empty plots blank
         n_plots = len(enrichment_plots_data_dict)
@@ -262,19 +256,23 @@ class LigandVsKinaseEvaluator:
         n_kinases = {}
         n_active_kinases = {}
 
-        for ligand_name, kinase_name in self.ligand_kinase_pairs_curated:
+        # Experimental enrichment for all ligand-kinase pairs at once
+        ligand_vs_kinase_datas = [
+            self.data_dict[ligand_name][kinase_name]
+            for ligand_name, kinase_name in self.ligand_kinase_pairs_curated
+        ]
+        ratios_ranked_data, ratios_active_kinases_identified = utils.enrichment_curves(
+            [utils.active_kinases(data) for data in ligand_vs_kinase_datas], utils.ENRICHMENT_TOP_X
+        )
+
+        for i, (ligand_name, kinase_name) in enumerate(self.ligand_kinase_pairs_curated):
 
             # Get data for current ligand-kinase pair
-            ligand_vs_kinase_data = self.data_dict[ligand_name][kinase_name]
+            ligand_vs_kinase_data = ligand_vs_kinase_datas[i]
             # Experimental enrichment (`experiment` : DataFrame)
-            experiment = [
-                utils.enrichment_top_x(
-                    ligand_vs_kinase_data,
-                    i,
-                )
-                for i in range(0, 101, 1)
-            ]
-            experiment = pd.DataFrame(experiment, columns=["x", kinase_name]).set_index("x")
+            experiment = pd.DataFrame(
+                {"x": ratios_ranked_data[i], kinase_name: ratios_active_kinases_identified[i]}
+            ).set_index("x")
 
             # Optimal enrichment (`optimum` : float)
             # Technically needs only to be calculated
@@ -322,14 +320,7 @@ class LigandVsKinaseEvaluator:
         axes = axes.reshape(-1)
 
         for i, (ligand_name, ef_df) in enumerate(data_dict.items()):
-            # Experimental curves
-            ef_df.plot(
-                title=ligand_name.upper(),
-                ax=axes[i],
-            )
-            # Cosmetics
-            axes[i].set_xlabel("${x\%}$")  # noqa: W605
-            axes[i].set_ylabel("$EF_{x\%}$")  # noqa: W605
+            _plot_enrichment_factor_panel(axes[i], ligand_name, ef_df)
 
         # Make empty plots blank
         n_plots = len(data_dict)
@@ -347,16 +338,19 @@ class LigandVsKinaseEvaluator:
             Enrichment plot data for ligands (keys): EF_x% values.
         """
 
-        data_dict = defaultdict(list)
-        for ligand_name, kinase_name in self.ligand_kinase_pairs_curated:
+        # Enrichment factors for all ligand-kinase pairs at once
+        top_x_list = utils.ENRICHMENT_FACTOR_TOP_X
+        efs = utils.enrichment_factors(
+            [
+                utils.active_kinases(self.data_dict[ligand_name][kinase_name])
+                for ligand_name, kinase_name in self.ligand_kinase_pairs_curated
+            ],
+            top_x_list,
+        )
 
-            # Get data for current ligand-kinase pair
-            ligand_vs_kinase_data = self.data_dict[ligand_name][kinase_name]
-            top_x_list = [1, 5, 10, 20, 25, 50]
-            data = [
-                utils.enrichment_factor_top_x(ligand_vs_kinase_data, top_x) for top_x in top_x_list
-            ]
-            data = pd.Series(data, index=top_x_list)
+        data_dict = defaultdict(list)
+        for i, (ligand_name, kinase_name) in enumerate(self.ligand_kinase_pairs_curated):
+            data = pd.Series(efs[i], index=top_x_list)
             data.name = kinase_name
             data_dict[ligand_name].append(data)
         data_dict = {
@@ -392,22 +386,9 @@ class LigandVsKinaseEvaluator:
         auc_dict = {}
 
         for i, (ligand_name, kinases_data) in enumerate(data_dict.items()):
-            for kinase_data in kinases_data:
-                kinase_name, fpr, tpr, auc, n_kinases, n_active_kinases = kinase_data
-                # Experimental curves
-                axes[i].plot(fpr, tpr, label=f"{kinase_name} (AUC={round(auc, 3)})")
+            _plot_roc_panel(axes[i], ligand_name, kinases_data)
+            for kinase_name, _, _, auc, _, _ in kinases_data:
                 auc_dict[f"{ligand_name}-{kinase_name}"] = auc
-            # Random curve
-            axes[i].plot([0, 1], [0, 1], label="Random", linestyle="--", color="grey")
-            axes[i].legend(title="On-targets")
-            # Cosmetics
-            axes[i].set_aspect(1.0 / axes[i].get_data_ratio(), adjustable="box")
-            axes[i].set_xlabel("FPR")
-            axes[i].set_ylabel("TPR")
-            axes[i].set_title(
-                f"{ligand_name.upper()} (in total {n_kinases} kinases, "
-                f"{n_active_kinases} active kinases)",
-            )
 
         # Make empty plots blank
         n_plots = len(data_dict)
@@ -423,6 +404,115 @@ class LigandVsKinaseEvaluator:
 
         return auc_dict
 
+    def export_plots(
+        self,
+        output_path,
+        plots=EXPORT_PLOTS,
+        figure_format="png",
+        dpi=300,
+        render=True,
+        n_processes=None,
+    ):
+        """
+        Export one figure per ligand (headless) and the underlying curve data for the enrichment,
+        enrichment factor, and ROC curve plots.
+
+        Unlike the `plot_*` methods (one multiplot figure for all ligands), each ligand panel is
+        rendered as a separate figure with the Agg backend in a worker process, so that batch
+        evaluations are not blocked by plotting and memory does not grow with the number of
+        ligands.
+
+        Parameters
+        ----------
+        output_path : str or pathlib.Path
+            Path to output folder. Figures are saved to `<plot>/<ligand>.<figure_format>` and
+            curve data to `<plot>.json`.
+        plots : list of str
+            Plot types: "enrichment", "enrichment_factors", and/or "roc_curves".
+        figure_format : str
+            Figure file format (default: "png").
+        dpi : int
+            Figure resolution (default: 300).
+        render : bool
+            Render figures (default: True); if False, only curve data is exported.
+        n_processes : int or None
+            Number of worker processes. If None, use the number of CPUs.
+
+        Returns
+        -------
+        list of pathlib.Path
+            Exported files.
+        """
+
+        unknown_plots = set(plots) - set(EXPORT_PLOTS)
+        if len(unknown_plots) > 0:
+            raise ValueError(
+                f"Unknown plot types: {', '.join(sorted(unknown_plots))}. "
+                f"Use one of these: {', '.join(EXPORT_PLOTS)}."
+            )
+        output_path = Path(output_path)
+        output_path.mkdir(parents=True, exist_ok=True)
+
+        plots_data = {
+            "enrichment": self._enrichment_plots_data,
+            "enrichment_factors": self._enrichment_factor_plots_data,
+            "roc_curves": self._roc_curves_data,
+        }
+        output_files = []
+        tasks = []
+        for plot in plots:
+            data_dict = plots_data[plot]()
+
+            # Curve data
+            json_path = output_path / f"{plot}.json"
+            with open(json_path, "w") as f:
+                json.dump(
+                    {
+                        ligand_name: _curve_data(plot, ligand_data)
+                        for ligand_name, ligand_data in data_dict.items()
+                    },
+                    f,
+                    separators=(",", ":"),
+                )
+            output_files.append(json_path)
+
+            # Figures
+            if render:
+                (output_path / plot).mkdir(exist_ok=True)
+                for ligand_name, ligand_data in data_dict.items():
+                    figure_name = f"{ligand_name.replace('/', '_')}.{figure_format}"
+                    figure_path = output_path / plot / figure_name
+                    tasks.append((plot, ligand_name, ligand_data, figure_path, dpi))
+
+        if len(tasks) > 0:
+            with multiprocessing.Pool(n_processes) as pool:
+                output_files.extend(pool.imap(_render_panel, tasks))
+
+        return output_files
+
+    def aucs(self):
+        """
+        Get ROC AUCs for all curated ligand-kinase pairs.
+
+        Returns
+        -------
+        pd.DataFrame
+            Ligand and kinase name, AUC, number of shared kinases, and number of shared active
+            kinases (columns) for each curated ligand-kinase pair (rows).
+        """
+
+        data_dict = self._roc_curves_data()
+
+        aucs = [
+            [ligand_name, kinase_name, auc, n_kinases, n_active_kinases]
+            for ligand_name, kinases_data in data_dict.items()
+            for kinase_name, _, _, auc, n_kinases, n_active_kinases in kinases_data
+        ]
+        return pd.DataFrame(
+            aucs,
+            columns=["ligand", "kinase", "auc", "n_kinases_shared", "n_active_kinases_shared"],
+        )
+
     def _roc_curves_data(self):
         """
         Get data for ROC curve plots per ligand for different ligand targets (multiplot).
@@ -436,17 +526,159 @@ class LigandVsKinaseEvaluator:
 
         data_dict = defaultdict(list)
 
-        for ligand_name, kinase_name in self.ligand_kinase_pairs_curated:
-
-            # Get data for current ligand-kinase pair
-            ligand_vs_kinase_data = self.data_dict[ligand_name][kinase_name]
-
-            fpr, tpr, auc, n_kinases, n_active_kinases = utils.roc_fpr_tpr_auc(
-                ligand_vs_kinase_data
-            )
-
+        # Calculate ROC curves and AUCs for all ligand-kinase pairs at once
+        pairs_data = [
+            self.data_dict[ligand_name][kinase_name]
+            for ligand_name, kinase_name in self.ligand_kinase_pairs_curated
+        ]
+        if len(pairs_data) == 0:
+            return data_dict
+        labels_scores = [utils.roc_labels_scores(pair_data) for pair_data in pairs_data]
+        y_trues = [y_true for y_true, _ in labels_scores]
+        y_scores = [y_score for _, y_score in labels_scores]
+        fprs, tprs, _ = utils.roc_curves(y_trues, y_scores)
+        aucs = utils.roc_auc(y_trues, y_scores)
+
+        for (ligand_name, kinase_name), ligand_vs_kinase_data, fpr, tpr, auc in zip(
+            self.ligand_kinase_pairs_curated, pairs_data, fprs, tprs, aucs
+        ):
             data_dict[ligand_name].append(
-                [kinase_name, fpr, tpr, auc, n_kinases, n_active_kinases]
+                [
+                    kinase_name,
+                    fpr,
+                    tpr,
+                    auc,
+                    ligand_vs_kinase_data.n_kinases_shared,
+                    ligand_vs_kinase_data.n_active_kinases_shared,
+                ]
             )
 
         return data_dict
+
+
+def _plot_enrichment_panel(ax, ligand_name, ligand_data):
+    """
+    Plot enrichment curves for one ligand (see `LigandVsKinaseEvaluator.plot_enrichment`).
+    """
+
+    experiment_df, optimum, n_kinases, n_active_kinases = ligand_data
+    # Experimental curves
+    experiment_df.plot(
+        title=(
+            f"{ligand_name.upper()} (in total {n_kinases} kinases, "
+            f"{n_active_kinases} active kinases)"
+        ),
+        ylim=(0, 101),
+        xlim=(-1, 100),
+        ax=ax,
+    )
+    # Optimal curve
+    ax.plot([0, optimum, 100], [0, 100, 100], label="Optimum", linestyle="--", color="k")
+    # Random curve
+    ax.plot([0, 100], [0, 100], label="Random", linestyle="--", color="grey")
+    ax.legend()
+    # Cosmetics
+    ax.set_aspect(1.0 / ax.get_data_ratio(), adjustable="box")
+    ax.set_xlabel("% ranked kissim dataset")
+    ax.set_ylabel("% true active kinases identified")
+
+
+def _plot_enrichment_factor_panel(ax, ligand_name, ef_df):
+    """
+    Plot enrichment factors for one ligand (see
+    `LigandVsKinaseEvaluator.plot_enrichment_factors`).
+    """
+
+    # Experimental curves
+    ef_df.plot(
+        title=ligand_name.upper(),
+        ax=ax,
+    )
+    # Cosmetics
+    ax.set_xlabel("${x\%}$")  # noqa: W605
+    ax.set_ylabel("$EF_{x\%}$")  # noqa: W605
+
+
+def _plot_roc_panel(ax, ligand_name, kinases_data):
+    """
+    Plot ROC curves for one ligand (see `LigandVsKinaseEvaluator.plot_roc_curves`).
+    """
+
+    for kinase_data in kinases_data:
+        kinase_name, fpr, tpr, auc, n_kinases, n_active_kinases = kinase_data
+        # Experimental curves
+        ax.plot(fpr, tpr, label=f"{kinase_name} (AUC={round(auc, 3)})")
+    # Random curve
+    ax.plot([0, 1], [0, 1], label="Random", linestyle="--", color="grey")
+    ax.legend(title="On-targets")
+    # Cosmetics
+    ax.set_aspect(1.0 / ax.get_data_ratio(), adjustable="box")
+    ax.set_xlabel("FPR")
+    ax.set_ylabel("TPR")
+    ax.set_title(
+        f"{ligand_name.upper()} (in total {n_kinases} kinases, "
+        f"{n_active_kinases} active kinases)",
+    )
+
+
+_PLOT_PANELS = {
+    "enrichment": _plot_enrichment_panel,
+    "enrichment_factors": _plot_enrichment_factor_panel,
+    "roc_curves": _plot_roc_panel,
+}
+
+
+def _render_panel(task):
+    """
+    Render one ligand panel as separate figure with the Agg backend (no pyplot figure manager,
+    so the figure is freed once saved).
+    """
+
+    plot, ligand_name, ligand_data, figure_path, dpi = task
+    figure = Figure(figsize=(5, 5))
+    FigureCanvasAgg(figure)
+    _PLOT_PANELS[plot](figure.subplots(), ligand_name, ligand_data)
+    figure.savefig(figure_path, bbox_inches="tight", dpi=dpi)
+    return figure_path
+
+
+def _curve_data(plot, ligand_data):
+    """
+    Get JSON-serializable curve data for one ligand panel (missing values as null).
+    """
+
+    if plot == "enrichment":
+        experiment_df, optimum, n_kinases, n_active_kinases = ligand_data
+        return {
+            "x": _to_list(experiment_df.index),
+            "y": {str(column): _to_list(experiment_df[column]) for column in experiment_df},
+            "optimum": _to_list([optimum])[0],
+            "n_kinases": int(n_kinases),
+            "n_active_kinases": int(n_active_kinases),
+        }
+    elif plot == "enrichment_factors":
+        return {
+            "x": _to_list(ligand_data.index),
+            "y": {str(column): _to_list(ligand_data[column]) for column in ligand_data},
+        }
+    else:
+        return [
+            {
+                "kinase": kinase_name,
+                "fpr": _to_list(fpr),
+                "tpr": _to_list(tpr),
+                "auc": _to_list([auc])[0],
+                "n_kinases": int(n_kinases),
+                "n_active_kinases": int(n_active_kinases),
+            }
+            for kinase_name, fpr, tpr, auc, n_kinases, n_active_kinases in ligand_data
+        ]
+
+
+def _to_list(values):
+    """
+    Cast values to a list of floats with None for missing values.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    return [None if np.isnan(value) else value for value in values.tolist()]
@@ -0,0 +1,401 @@
+"""
+Evaluate ligand-kinase pairs for a grid of evaluation setups (sweep) in parallel.
+
+Each setup is a combination of a kinase-kinase dataset file (e.g. the KiSSim kinase matrix for
+a feature weighting scheme), a ligand profiling method, a kinase activity cutoff, and a minimum
+number of shared kinases. The AUCs of all setups are written to one CSV file as soon as a setup
+is finished; a restarted sweep skips all setups that are already in this file.
+
+Command line usage (see `python -m src.evaluation.sweep --help`):
+
+    python -m src.evaluation.sweep auc_sweep.csv \\
+        -k fingerprint_distances_to_kinase_matrix_100.csv \\
+        -k fingerprint_distances_to_kinase_matrix_110.csv \\
+        -l karaman-davis -c 100 -m 10 -n 4
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src import data
+from src.evaluation.ligand_vs_kinase_evaluator import LigandVsKinaseEvaluator
+from src.paths import PATH_DATA
+from src.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+SWEEP_PATH = PATH_DATA / "interim/sweep"
+# Setup parameters that span the sweep grid (and are columns in the result table)
+GRID_COLUMNS = [
+    "kinase_kinase_path",
+    "ligand_kinase_method",
+    "kinase_activity_cutoff",
+    "min_n_shared_kinases",
+]
+# Result columns per ligand-kinase pair (see `LigandVsKinaseEvaluator.aucs`)
+AUC_COLUMNS = ["ligand", "kinase", "auc", "n_kinases_shared", "n_active_kinases_shared"]
+
+# Matrices shared by all setups evaluated in a worker process (set by `_init_worker`)
+_matrices = {}
+
+
+def sweep_grid(
+    kinase_kinase_paths=(None,),
+    ligand_kinase_methods=("karaman-davis",),
+    kinase_activity_cutoffs=(100,),
+    min_n_shared_kinases=(10,),
+    **options,
+):
+    """
+    Get all evaluation setups of a sweep grid.
+
+    Parameters
+    ----------
+    kinase_kinase_paths : list of (str or pathlib.Path or None)
+        Kinase-kinase dataset files (None: default file of the kinase-kinase method).
+    ligand_kinase_methods : list of str
+        Ligand profiling methods.
+    kinase_activity_cutoffs : list of float
+        Kinase activity cutoffs.
+    min_n_shared_kinases : list of int
+        Minimum numbers of shared kinases per ligand-kinase pair.
+    **options
+        Evaluation options shared by all setups (see `run_sweep`).
+
+    Returns
+    -------
+    list of dict
+        Evaluation setups; each setup has a unique ID ("sweep_id").
+    """
+
+    setups = []
+    for kinase_kinase_path, ligand_kinase_method, cutoff, min_n in itertools.product(
+        kinase_kinase_paths, ligand_kinase_methods, kinase_activity_cutoffs, min_n_shared_kinases
+    ):
+        setup = {
+            "kinase_kinase_path": None if kinase_kinase_path is None else str(kinase_kinase_path),
+            "ligand_kinase_method": ligand_kinase_method,
+            "kinase_activity_cutoff": float(cutoff),
+            "min_n_shared_kinases": int(min_n),
+            **options,
+        }
+        setup_string = json.dumps(setup, sort_keys=True)
+        setup["sweep_id"] = hashlib.sha1(setup_string.encode()).hexdigest()[:12]
+        setups.append(setup)
+    return setups
+
+
+def run_sweep(
+    output_path,
+    ligand_kinase_pairs=None,
+    kinase_kinase_paths=(None,),
+    ligand_kinase_methods=("karaman-davis",),
+    kinase_activity_cutoffs=(100,),
+    min_n_shared_kinases=(10,),
+    kinase_kinase_method="kissim",
+    kinase_activity_max=True,
+    min_n_shared_active_kinases=3,
+    pkidb_ligands=True,
+    fda_approved=False,
+    kinmap_kinases=True,
+    n_processes=None,
+):
+    """
+    Evaluate all setups of a sweep grid in parallel and write their AUCs to one CSV file.
+
+    Each dataset is loaded only once and saved as NPY file that all worker processes
+    memory-map, so that the workers share the same physical pages instead of holding a copy of
+    each matrix. AUCs are appended to the output file as soon as a setup is finished and
+    finished setups are listed in `<output_path>.done`; a restarted sweep skips these setups.
+
+    Parameters
+    ----------
+    output_path : str or pathlib.Path
+        Path to output CSV file.
+    ligand_kinase_pairs : list of list of str or None
+        Ligand-kinase pairs to be evaluated. If None, use all ligands in each profiling dataset
+        paired with their PKIDB targets.
+    kinase_kinase_paths, ligand_kinase_methods, kinase_activity_cutoffs, min_n_shared_kinases
+        Sweep grid, see `sweep_grid`.
+    kinase_kinase_method : str
+        Kinase distances method.
+    kinase_activity_max : bool
+        Use activity cutoffs as maximum (True) or minimum (False) cutoffs.
+    min_n_shared_active_kinases : int
+        Minimum number of shared active kinases per ligand-kinase pair.
+    pkidb_ligands, fda_approved, kinmap_kinases : bool
+        Dataset options, see `src.evaluation.LigandVsKinaseEvaluator`.
+    n_processes : int or None
+        Number of worker processes. If None, use the number of CPUs.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Setup (grid columns), ligand and kinase name, AUC, number of shared kinases, and number
+        of shared active kinases (columns) for each ligand-kinase pair and setup (rows).
+    """
+
+    output_path = Path(output_path)
+    setups = sweep_grid(
+        kinase_kinase_paths,
+        ligand_kinase_methods,
+        kinase_activity_cutoffs,
+        min_n_shared_kinases,
+        kinase_kinase_method=kinase_kinase_method,
+        kinase_activity_max=kinase_activity_max,
+        min_n_shared_active_kinases=min_n_shared_active_kinases,
+        pkidb_ligands=pkidb_ligands,
+        fda_approved=fda_approved,
+        kinmap_kinases=kinmap_kinases,
+    )
+    done_ids = _resume(output_path)
+    setups = [setup for setup in setups if setup["sweep_id"] not in done_ids]
+    logger.info(f"Sweep setups: {len(done_ids)} done, {len(setups)} to do.")
+
+    if len(setups) > 0:
+        SWEEP_PATH.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=SWEEP_PATH) as matrix_dir:
+
+            # Load each dataset once and save it for the worker processes
+            matrix_files = {}
+            pairs = {}
+            for method in sorted({setup["ligand_kinase_method"] for setup in setups}):
+                profiling_df = data.profiling.load(
+                    method,
+                    pkidb_ligands=pkidb_ligands,
+                    fda_approved=fda_approved,
+                    kinmap_kinases=kinmap_kinases,
+                )
+                matrix_files[("ligand_kinase", method)] = _save_matrix(profiling_df, matrix_dir)
+                if ligand_kinase_pairs is None:
+                    pairs[method] = _ligand_kinase_pairs(profiling_df, fda_approved)
+                else:
+                    pairs[method] = ligand_kinase_pairs
+            for path in sorted({setup["kinase_kinase_path"] or "" for setup in setups}):
+                distances_df = data.distances.load(
+                    kinase_kinase_method,
+                    kinmap_kinases=kinmap_kinases,
+                    distances_path=path or None,
+                )
+                matrix_files[("kinase_kinase", path)] = _save_matrix(distances_df, matrix_dir)
+
+            tasks = [(setup, pairs[setup["ligand_kinase_method"]]) for setup in setups]
+            with multiprocessing.Pool(
+                n_processes, initializer=_init_worker, initargs=(matrix_files,)
+            ) as pool:
+                for i, (setup, aucs) in enumerate(pool.imap_unordered(_evaluate, tasks), 1):
+                    _append(output_path, setup, aucs)
+                    logger.info(f"Sweep setup {i}/{len(tasks)} done: {setup['sweep_id']}")
+
+    if not output_path.exists():
+        return pd.DataFrame(columns=["sweep_id"] + GRID_COLUMNS + AUC_COLUMNS)
+    return pd.read_csv(output_path)
+
+
+def _resume(output_path):
+    """
+    Get the IDs of finished setups and remove results of unfinished setups from the output file.
+    Only files written by a sweep are changed: An output file without list of finished setups
+    or without "sweep_id" column raises an error.
+    """
+
+    done_path = _done_path(output_path)
+    if not output_path.exists():
+        if done_path.exists():
+            done_path.unlink()
+        return set()
+    if not done_path.exists():
+        raise FileExistsError(
+            f"Output file exists but was not written by a sweep (no {done_path.name} file): "
+            f"{output_path}. Choose another output path or remove the file."
+        )
+
+    with open(done_path, "r") as f:
+        done_ids = {line.strip() for line in f if line.strip()}
+    results = pd.read_csv(output_path, dtype={"sweep_id": str})
+    if "sweep_id" not in results.columns:
+        raise ValueError(f"Output file has no sweep_id column: {output_path}")
+    finished = results["sweep_id"].isin(done_ids)
+    if not finished.all():
+        logger.info(f"Remove {(~finished).sum()} results of unfinished sweep setups.")
+        atomic_write(output_path, lambda path: results[finished].to_csv(path, index=False))
+    return done_ids
+
+
+def _append(output_path, setup, aucs):
+    """
+    Append the AUCs of a finished setup to the output file and mark the setup as done.
+    """
+
+    results = pd.DataFrame(
+        {column: setup[column] for column in ["sweep_id"] + GRID_COLUMNS}, index=aucs.index
+    )
+    results = pd.concat([results, aucs], axis=1)
+    results.to_csv(output_path, mode="a", header=not output_path.exists(), index=False)
+    # Mark as done only after the results are written
+    with open(_done_path(output_path), "a") as f:
+        f.write(f"{setup['sweep_id']}\n")
+
+
+def _done_path(output_path):
+    """
+    Get path to the file that lists the finished setups.
+    """
+
+    return output_path.with_name(f"{output_path.name}.done")
+
+
+def _ligand_kinase_pairs(profiling_df, fda_approved):
+    """
+    Get all ligand-target pairs (PKIDB targets) for the ligands in a profiling dataset.
+    """
+
+    ligand_targets = data.targets.pkidb(profiling_df.columns, fda_approved=fda_approved)
+    return (
+        ligand_targets[["ligand.input", "targets.kinmap"]]
+        .explode("targets.kinmap")
+        .to_numpy()
+        .tolist()
+    )
+
+
+def _save_matrix(matrix, matrix_dir):
+    """
+    Save matrix values as NPY file; return path, index, and columns to rebuild the matrix.
+    """
+
+    matrix_path = Path(matrix_dir) / f"matrix_{len(os.listdir(matrix_dir))}.npy"
+    np.save(matrix_path, matrix.to_numpy(dtype=np.float64))
+    return str(matrix_path), matrix.index.to_list(), matrix.columns.to_list()
+
+
+def _init_worker(matrix_files):
+    """
+    Memory-map all matrices once per worker process.
+    """
+
+    for key, (matrix_path, index, columns) in matrix_files.items():
+        values = np.load(matrix_path, mmap_mode="r")
+        _matrices[key] = pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+
+def _evaluate(task):
+    """
+    Evaluate one setup; return the setup and the AUCs of all curated ligand-kinase pairs.
+    """
+
+    setup, ligand_kinase_pairs = task
+    evaluator = LigandVsKinaseEvaluator(
+        ligand_kinase_pairs,
+        setup["ligand_kinase_method"],
+        setup["kinase_kinase_method"],
+        setup["kinase_activity_cutoff"],
+        setup["kinase_activity_max"],
+        setup["min_n_shared_kinases"],
+        setup["min_n_shared_active_kinases"],
+        ligand_kinase_matrix=_matrices[("ligand_kinase", setup["ligand_kinase_method"])],
+        kinase_kinase_matrix=_matrices[("kinase_kinase", setup["kinase_kinase_path"] or "")],
+    )
+    return setup, evaluator.aucs()
+
+
+@click.command()
+@click.argument("output_path", type=click.Path())
+@click.option(
+    "-k",
+    "--kinase-kinase-path",
+    multiple=True,
+    type=click.Path(exists=True),
+    help="Kinase-kinase dataset file (repeat for multiple files; default: method default).",
+)
+@click.option(
+    "-l",
+    "--ligand-kinase-method",
+    multiple=True,
+    default=["karaman-davis"],
+    show_default=True,
+    help="Ligand profiling method (repeat for multiple methods).",
+)
+@click.option(
+    "-c",
+    "--kinase-activity-cutoff",
+    multiple=True,
+    type=float,
+    default=[100],
+    show_default=True,
+    help="Kinase activity cutoff (repeat for multiple cutoffs).",
+)
+@click.option(
+    "-m",
+    "--min-n-shared-kinases",
+    multiple=True,
+    type=int,
+    default=[10],
+    show_default=True,
+    help="Minimum number of shared kinases (repeat for multiple values).",
+)
+@click.option("--kinase-kinase-method", default="kissim", show_default=True)
+@click.option(
+    "--kinmap-kinases/--no-kinmap-kinases",
+    default=True,
+    show_default=True,
+    help="Map kinase names to KinMap kinase names.",
+)
+@click.option(
+    "--pkidb-ligands/--no-pkidb-ligands",
+    default=True,
+    show_default=True,
+    help="Keep only PKIDB ligands.",
+)
+@click.option(
+    "--fda-approved",
+    is_flag=True,
+    default=False,
+    help="Keep only FDA-approved PKIDB ligands (only with --pkidb-ligands).",
+)
+@click.option("-n", "--n-processes", type=int, default=None, help="Number of processes.")
+def main(
+    output_path,
+    kinase_kinase_path,
+    ligand_kinase_method,
+    kinase_activity_cutoff,
+    min_n_shared_kinases,
+    kinase_kinase_method,
+    kinmap_kinases,
+    pkidb_ligands,
+    fda_approved,
+    n_processes,
+):
+    """
+    Evaluate a sweep grid of evaluation setups and write all AUCs to OUTPUT_PATH (CSV).
+    """
+
+    run_sweep(
+        output_path,
+        kinase_kinase_paths=kinase_kinase_path or (None,),
+        ligand_kinase_methods=ligand_kinase_method,
+        kinase_activity_cutoffs=kinase_activity_cutoff,
+        min_n_shared_kinases=min_n_shared_kinases,
+        kinase_kinase_method=kinase_kinase_method,
+        pkidb_ligands=pkidb_ligands,
+        fda_approved=fda_approved,
+        kinmap_kinases=kinmap_kinases,
+        n_processes=n_processes,
+    )
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
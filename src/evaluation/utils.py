@@ -2,7 +2,11 @@
 Calculate enrichment values.
 """
 
-from sklearn import metrics
+import numpy as np
+
+# x values for enrichment curves (top x% of ranked kinases) and enrichment factors
+ENRICHMENT_TOP_X = np.arange(0, 101, 1)
+ENRICHMENT_FACTOR_TOP_X = [1, 5, 10, 20, 25, 50]
 
 
 def roc_fpr_tpr_auc(ligand_vs_kinase_data):
@@ -17,7 +21,7 @@ def roc_fpr_tpr_auc(ligand_vs_kinase_data):
     Returns
     -------
     list
-        FPR, TPR, AUC, number of shared kinases, number of shared active kinases.Visualize ROC curves.
+        FPR, TPR, AUC, number of shared kinases, number of shared active kinases.
 
     References
     ----------
@@ -25,29 +29,201 @@ def roc_fpr_tpr_auc(ligand_vs_kinase_data):
     - ROC curve: https://scikit-learn.org/stable/modules/generated/sklearn.metrics.roc_curve.html#sklearn.metrics.roc_curve)  # noqa: E501
     """
 
+    y_true, y_score = roc_labels_scores(ligand_vs_kinase_data)
+    fpr, tpr, _ = roc_curves(y_true, y_score)
+    auc = roc_auc(y_true, y_score)
+    n_kinases_shared = ligand_vs_kinase_data.n_kinases_shared
+    n_active_kinases_shared = ligand_vs_kinase_data.n_active_kinases_shared
+
+    return fpr, tpr, auc, n_kinases_shared, n_active_kinases_shared
+
+
+def roc_labels_scores(ligand_vs_kinase_data):
+    """
+    Get ROC labels (active kinases) and scores (kinase similarities) for a ligand-kinase pair.
+
+    Parameters
+    ----------
+    ligand_vs_kinase_data : src.evaluation.data.LigandVsKinaseData
+        Ligand-kinase pair data.
+
+    Returns
+    -------
+    y_true : numpy.ndarray
+        Active kinase labels (bool).
+    y_score : numpy.ndarray
+        Kinase similarities (float).
+    """
+
     data = ligand_vs_kinase_data.data
-    # data[f"{ligand_vs_kinase_data.kinase_kinase_method}.measure"] = range(0, len(data))
 
     # Get labels
-    y_true = data[f"{ligand_vs_kinase_data.ligand_kinase_method}.active"].to_list()
+    y_true = active_kinases(ligand_vs_kinase_data)
     # Get scores
-    y_score = data[f"{ligand_vs_kinase_data.kinase_kinase_method}.measure"]
+    y_score = data[f"{ligand_vs_kinase_data.kinase_kinase_method}.measure"].to_numpy(
+        dtype=np.float64
+    )
     # TPR and FPR values are calculated based on different threshold values that will
     # cast the `y_score` values to True or False, if `y_score` >= `threshold`
     # Our score describes distances; if we want our score to be True if >= `threshold`,
     # we will need to convert distances to similarities
     # In short: `y_score` needs descending values!
-    y_score = (1 - y_score / y_score.max()).to_list()
-    pos_label = True
+    y_score = 1 - y_score / y_score.max()
 
-    # `roc_curve` returns `(fpr, tpr, thresholds)`; number of thresholds and their values seem
-    # to be set based on the input data
-    fpr, tpr, _ = metrics.roc_curve(y_true, y_score, pos_label=pos_label)
-    auc = metrics.roc_auc_score(y_true, y_score)
-    n_kinases_shared = ligand_vs_kinase_data.n_kinases_shared
-    n_active_kinases_shared = ligand_vs_kinase_data.n_active_kinases_shared
+    return y_true, y_score
 
-    return fpr, tpr, auc, n_kinases_shared, n_active_kinases_shared
+
+def roc_curves(y_true, y_score, drop_intermediate=True):
+    """
+    Calculate ROC curves for one or more ligand-kinase pairs at once (same as
+    `sklearn.metrics.roc_curve` per pair, including tied scores and dropped intermediate
+    thresholds).
+
+    Scores of all pairs are sorted at once (by pair, then by descending score) and true and
+    false positives are counted with one cumulative sum.
+
+    Parameters
+    ----------
+    y_true : array-like of bool or list of array-like of bool
+        Labels (True for positives); for multiple pairs pass a list of label arrays (may differ
+        in length).
+    y_score : array-like of float or list of array-like of float
+        Scores (higher scores for positives); same shape(s) as `y_true`.
+    drop_intermediate : bool
+        Drop thresholds that do not change the curve shape (default: True).
+
+    Returns
+    -------
+    fpr : numpy.ndarray or list of numpy.ndarray
+        False positive rates (per pair). NaN if a pair has no negatives.
+    tpr : numpy.ndarray or list of numpy.ndarray
+        True positive rates (per pair). NaN if a pair has no positives.
+    thresholds : numpy.ndarray or list of numpy.ndarray
+        Decreasing score thresholds (per pair); the first threshold is infinite.
+    """
+
+    y_trues, single = _as_batch(y_true, bool)
+    y_scores, _ = _as_batch(y_score, np.float64)
+    y_true, y_score, offsets, sizes = _sort_batch(y_trues, y_scores)
+
+    # True and false positives for each threshold, i.e. up to and including each position
+    positions = np.arange(len(y_true)) - np.repeat(offsets, sizes)
+    tps = np.cumsum(y_true, dtype=np.float64)
+    tps -= np.repeat(np.concatenate([[0], tps])[offsets], sizes)
+    fps = 1 + positions - tps
+    # Keep only the last position per distinct score (and pair)
+    distinct = np.ones(len(y_score), dtype=bool)
+    distinct[:-1] = (y_score[1:] != y_score[:-1]) | (positions[1:] == 0)
+
+    fprs, tprs, thresholds = [], [], []
+    for offset, size in zip(offsets, sizes):
+        pair = slice(offset, offset + size)
+        pair_distinct = distinct[pair]
+        pair_tps = tps[pair][pair_distinct]
+        pair_fps = fps[pair][pair_distinct]
+        pair_thresholds = y_score[pair][pair_distinct]
+
+        if drop_intermediate and len(pair_fps) > 2:
+            optimal = np.concatenate(
+                [
+                    [True],
+                    np.logical_or(np.diff(pair_fps, 2), np.diff(pair_tps, 2)),
+                    [True],
+                ]
+            )
+            pair_tps = pair_tps[optimal]
+            pair_fps = pair_fps[optimal]
+            pair_thresholds = pair_thresholds[optimal]
+
+        # Add an extra threshold position to make sure that the curve starts at (0, 0)
+        pair_tps = np.concatenate([[0.0], pair_tps])
+        pair_fps = np.concatenate([[0.0], pair_fps])
+        pair_thresholds = np.concatenate([[np.inf], pair_thresholds])
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fprs.append(pair_fps / pair_fps[-1] if pair_fps[-1] > 0 else pair_fps * np.nan)
+            tprs.append(pair_tps / pair_tps[-1] if pair_tps[-1] > 0 else pair_tps * np.nan)
+        thresholds.append(pair_thresholds)
+
+    if single:
+        return fprs[0], tprs[0], thresholds[0]
+    return fprs, tprs, thresholds
+
+
+def roc_auc(y_true, y_score):
+    """
+    Calculate ROC AUC for one or more ligand-kinase pairs at once.
+
+    The AUC is calculated as the Mann-Whitney U statistic from score ranks (tied scores get
+    their average rank), which equals the area under the ROC curve including tied scores
+    (`sklearn.metrics.roc_auc_score`).
+
+    Parameters
+    ----------
+    y_true : array-like of bool or list of array-like of bool
+        Labels (True for positives); for multiple pairs pass a list of label arrays (may differ
+        in length).
+    y_score : array-like of float or list of array-like of float
+        Scores (higher scores for positives); same shape(s) as `y_true`.
+
+    Returns
+    -------
+    float or numpy.ndarray
+        AUC (per pair). NaN if a pair has only positives or only negatives.
+    """
+
+    y_trues, single = _as_batch(y_true, bool)
+    y_scores, _ = _as_batch(y_score, np.float64)
+    y_true, y_score, offsets, sizes = _sort_batch(y_trues, y_scores, descending=False)
+    pairs = np.repeat(np.arange(len(sizes)), sizes)
+
+    # Average rank (1-based, per pair) of each block of tied scores
+    block_starts = np.ones(len(y_score), dtype=bool)
+    block_starts[1:] = (y_score[1:] != y_score[:-1]) | (pairs[1:] != pairs[:-1])
+    blocks = np.cumsum(block_starts) - 1
+    positions = np.arange(len(y_score)) - np.repeat(offsets, sizes) + 1
+    block_ranks = np.bincount(blocks, weights=positions) / np.bincount(blocks)
+    ranks = block_ranks[blocks]
+
+    n_positives = np.bincount(pairs, weights=y_true, minlength=len(sizes))
+    n_negatives = sizes - n_positives
+    rank_sums = np.bincount(pairs, weights=ranks * y_true, minlength=len(sizes))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        aucs = (rank_sums - n_positives * (n_positives + 1) / 2) / (n_positives * n_negatives)
+    aucs[(n_positives == 0) | (n_negatives == 0)] = np.nan
+
+    if single:
+        return aucs[0]
+    return aucs
+
+
+def _as_batch(arrays, dtype):
+    """
+    Cast a single array (array, Series, or list of scalars) or a list of arrays to a list of
+    arrays; return also whether a single array was given.
+    """
+
+    single = not isinstance(arrays, list) or len(arrays) == 0 or np.ndim(arrays[0]) == 0
+    if single:
+        return [np.asarray(arrays, dtype=dtype)], True
+    return [np.asarray(array, dtype=dtype) for array in arrays], False
+
+
+def _sort_batch(y_trues, y_scores, descending=True):
+    """
+    Concatenate labels and scores of multiple pairs and sort them by pair and score.
+    """
+
+    sizes = np.array([len(y_score) for y_score in y_scores], dtype=np.int64)
+    if any(len(y_true) != size for y_true, size in zip(y_trues, sizes)):
+        raise ValueError("Labels and scores must have the same length.")
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    y_true = np.concatenate(y_trues)
+    y_score = np.concatenate(y_scores)
+    pairs = np.repeat(np.arange(len(sizes)), sizes)
+    order = np.lexsort((-y_score if descending else y_score, pairs))
+
+    return y_true[order], y_score[order], offsets, sizes
 
 
 def enrichment_plot_data(ligand_vs_kinase_data):
@@ -81,10 +257,123 @@ def enrichment_plot_data(ligand_vs_kinase_data):
     y = n_s / n
     """
 
-    enrichment_data = [enrichment_top_x(ligand_vs_kinase_data, i) for i in range(0, 101, 1)]
+    ratios_ranked_data, ratios_active_kinases_identified = enrichment_curves(
+        active_kinases(ligand_vs_kinase_data), ENRICHMENT_TOP_X
+    )
+    enrichment_data = list(zip(ratios_ranked_data, ratios_active_kinases_identified))
     return enrichment_data
 
 
+def active_kinases(ligand_vs_kinase_data):
+    """
+    Get active kinase labels for a ligand-kinase pair.
+
+    Parameters
+    ----------
+    ligand_vs_kinase_data : src.evaluation.data.LigandVsKinaseData
+        Ligand-kinase pair data.
+
+    Returns
+    -------
+    numpy.ndarray
+        Active kinase labels (bool) for all shared kinases, ranked by the kinase-kinase method.
+    """
+
+    data = ligand_vs_kinase_data.data
+    return data[f"{ligand_vs_kinase_data.ligand_kinase_method}.active"].to_numpy(dtype=bool)
+
+
+def enrichment_curves(active, top_x=ENRICHMENT_TOP_X):
+    """
+    Calculate the enrichment in the top x% of ranked kinases for multiple x values (enrichment
+    curve) for one or more ligand-kinase pairs at once.
+
+    The number of active kinases in the top x% is read from one cumulative sum over the active
+    kinase labels of all pairs (concatenated), instead of counting active kinases per pair and
+    x value.
+
+    Parameters
+    ----------
+    active : array-like of bool or list of array-like of bool
+        Active kinase labels for kinases ranked by the kinase-kinase method (see
+        `active_kinases`); for multiple pairs pass a list of label arrays (may differ in length).
+    top_x : array-like of float
+        The top x% of ranked kinases (default: 0, 1, ..., 100).
+
+    Returns
+    -------
+    ratios_ranked_data : numpy.ndarray
+        Percentage of ranked data in top x% (x values in enrichment plot) for all x values
+        (columns) and pairs (rows); 1D if a single label array is given.
+    ratios_active_kinases_identified : numpy.ndarray
+        Percentage of active kinases in top x% (y values in enrichment plot) for all x values
+        (columns) and pairs (rows); 1D if a single label array is given.
+
+    Notes
+    -----
+    See notes in `enrichment_plot_data`.
+    """
+
+    actives, single = _as_batch(active, bool)
+    top_x = np.asarray(top_x, dtype=np.float64)
+
+    n_kinases_total = np.array([len(a) for a in actives])
+    offsets = np.concatenate([[0], np.cumsum(n_kinases_total)[:-1]])
+    # Number of active kinases in the first i kinases of all pairs (concatenated)
+    n_active_kinases_cumulative = np.concatenate([[0], np.cumsum(np.concatenate(actives))])
+    n_active_kinases_before = n_active_kinases_cumulative[offsets]
+    n_active_kinases_total = (
+        n_active_kinases_cumulative[offsets + n_kinases_total] - n_active_kinases_before
+    )
+
+    # Number of kinases in top x% (same rounding as `enrichment_top_x`)
+    n_kinases_top_x = (n_kinases_total[:, None] * top_x[None, :] / 100.0).astype(np.int64)
+    n_active_kinases_top_x = n_active_kinases_cumulative[offsets[:, None] + n_kinases_top_x]
+    n_active_kinases_top_x -= n_active_kinases_before[:, None]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratios_ranked_data = n_kinases_top_x / n_kinases_total[:, None] * 100
+        ratios_active_kinases_identified = (
+            n_active_kinases_top_x / n_active_kinases_total[:, None] * 100
+        )
+
+    if single:
+        return ratios_ranked_data[0], ratios_active_kinases_identified[0]
+    return ratios_ranked_data, ratios_active_kinases_identified
+
+
+def enrichment_factors(active, top_x=ENRICHMENT_FACTOR_TOP_X):
+    """
+    Calculate the enrichment factors for the top x% of ranked kinases for multiple x values for
+    one or more ligand-kinase pairs at once.
+
+    Parameters
+    ----------
+    active : array-like of bool or list of array-like of bool
+        Active kinase labels for kinases ranked by the kinase-kinase method (see
+        `active_kinases`); for multiple pairs pass a list of label arrays (may differ in length).
+    top_x : array-like of float
+        The top x% of ranked kinases (default: 1, 5, 10, 20, 25, 50).
+
+    Returns
+    -------
+    numpy.ndarray
+        Enrichment factors for all x values (columns) and pairs (rows); 1D if a single label
+        array is given.
+
+    Notes
+    -----
+    See notes in `enrichment_factor_top_x`.
+    """
+
+    ratios_ranked_data, ratios_active_kinases_identified = enrichment_curves(active, top_x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        efs = np.where(
+            ratios_ranked_data > 0, ratios_active_kinases_identified / ratios_ranked_data, 0
+        )
+    return efs
+
+
 def enrichment_top_x(ligand_vs_kinase_data, top_x):
     """
     Calculate the enrichment in the top x% (`top_x`) of ranked kinases.
@@ -205,7 +494,7 @@ def enrichment_factor_top_x(ligand_vs_kinase_data, top_x):
     EFx% = (n_s / n) / (N_s / N)
     """
 
-    ratio_active_kinases_identified, ratio_ranked_data = enrichment_top_x(
+    ratio_ranked_data, ratio_active_kinases_identified = enrichment_top_x(
         ligand_vs_kinase_data, top_x
     )
     if ratio_ranked_data > 0:
@@ -2,10 +2,17 @@
 Utitlity functions.
 """
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import numpy as np
+import pandas as pd
+from scipy.stats import norm
 
 
-def check_distance_matrix(matrix):
+def check_distance_matrix(matrix, n_triplets=None):
     """
     Check conditions for distance matrix.
 
@@ -13,7 +20,20 @@ def check_distance_matrix(matrix):
     ----------
     matrix : np.array
         The matrix for which the condition should be checked.
+    n_triplets : int or None
+        If None, check all conditions exactly. Else, estimate the triangular inequality
+        violation rate from `n_triplets` sampled triplets (for large matrices, see
+        `distance_matrix_report`).
+
+    Returns
+    -------
+    src.utils.DistanceMatrixReport or None
+        Diagnostics report if `n_triplets` is set.
     """
+    if n_triplets is not None:
+        report = distance_matrix_report(matrix, n_triplets=n_triplets)
+        print(report)
+        return report
     print(f"{'Matrix 2D and square?:' : <30}{_check_dimensionality(matrix)}")
     print(f"{'Matrix positive?:' : <30}{_check_positivity(matrix)}")
     print(f"{'Matrix diagonale 0?:' : <30}{_check_null_diagonal(matrix)}")
@@ -116,12 +136,412 @@ def _check_triangular_inequality(matrix, tolerance=0.11):
     bool :
         True if the condition is met, False otherwise.
     """
-    triang_inequality = None
-    for i in range(matrix.shape[0]):
-        for j in range(matrix.shape[0]):
-            for k in range(matrix.shape[0]):
-                if matrix[i, j] <= matrix[i, k] + matrix[k, j] + tolerance:
-                    triang_inequality = True
+    violations = triangular_inequality_violations(matrix, tolerance, max_violations=1)
+    return violations["n_violations"] == 0
+
+
+def triangular_inequality_violations(
+    matrix,
+    tolerance=0.11,
+    max_violations=None,
+    n_samples=10,
+    block_size=128,
+    n_threads=None,
+    nan_policy="violation",
+):
+    """
+    Find triplets (i, j, k) that violate the triangular inequality, i.e.
+    matrix[i, j] > matrix[i, k] + matrix[k, j] + tolerance.
+
+    All triplets are checked with NumPy in tiles of `block_size` x `block_size` x `block_size`
+    triplets (detours matrix[i, k] + matrix[k, j] for a block of i, k, and j each); violating
+    triplets are only searched in tiles with violations. Blocks of i are checked in parallel
+    threads (NumPy releases the GIL).
+
+    Parameters
+    ----------
+    matrix : np.array or pd.DataFrame
+        Square distance matrix.
+    tolerance : float
+        The accepted tolerance for approximation.
+    max_violations : int or None
+        Stop as soon as at least this number of violations is found (early exit). If None,
+        count all violations.
+    n_samples : int
+        Maximum number of violating triplets to be returned.
+    block_size : int
+        Tile edge length.
+    n_threads : int or None
+        Number of threads. If None, use the number of CPUs.
+    nan_policy : str
+        Triplets with missing distances (NaN) are counted as violations ("violation", default;
+        as in `_check_triangular_inequality`) or ignored ("ignore").
+
+    Returns
+    -------
+    dict
+        - "n_violations" (int): number of violating triplets (lower bound if stopped early)
+        - "complete" (bool): True if all triplets were checked
+        - "worst_violation" (float or None): largest matrix[i, j] - matrix[i, k] - matrix[k, j]
+          of all violating triplets found without missing distances
+        - "worst_triplet" (tuple of int or None): (i, j, k) for the worst violation
+        - "triplets" (list of tuple of int): up to `n_samples` violating triplets (i, j, k)
+    """
+    if nan_policy not in ["violation", "ignore"]:
+        raise ValueError(f"Unknown nan_policy: {nan_policy}. Use 'violation' or 'ignore'.")
+    matrix = np.asarray(matrix, dtype=np.float64)
+    _check_dimensionality(matrix)
+    n = matrix.shape[0]
+    blocks = [slice(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    stop = threading.Event()
+    lock = threading.Lock()
+    result = {
+        "n_violations": 0,
+        "complete": True,
+        "worst_violation": None,
+        "worst_triplet": None,
+        "triplets": [],
+    }
+
+    def _check_row_block(block_i):
+        for block_k in blocks:
+            for block_j in blocks:
+                if stop.is_set():
+                    return
+                # Excess of direct distance over detour via k for all (i, k, j) in tile
+                excess = matrix[block_i, None, block_j] - matrix[block_i, block_k, None]
+                excess -= matrix[None, block_k, block_j]
+                if nan_policy == "violation":
+                    # NaN comparisons are False, i.e. NaN triplets do not meet the inequality
+                    violations = ~(excess <= tolerance)
+                else:
+                    violations = excess > tolerance
+                if not violations.any():
+                    continue
+                i, k, j = np.nonzero(violations)
+                excess_ikj = excess[i, k, j]
+                if np.isnan(excess_ikj).all():
+                    worst, worst_violation = None, None
                 else:
-                    return False
-    return triang_inequality
+                    worst = np.nanargmax(excess_ikj)
+                    worst_violation = float(excess_ikj[worst])
+                i += block_i.start
+                j += block_j.start
+                k += block_k.start
+                with lock:
+                    result["n_violations"] += len(i)
+                    worst_so_far = result["worst_violation"]
+                    if worst_violation is not None:
+                        if worst_so_far is None or worst_violation > worst_so_far:
+                            result["worst_violation"] = worst_violation
+                            result["worst_triplet"] = (int(i[worst]), int(j[worst]), int(k[worst]))
+                    n_missing = n_samples - len(result["triplets"])
+                    result["triplets"].extend(
+                        (int(i_), int(j_), int(k_))
+                        for i_, j_, k_ in zip(i[:n_missing], j[:n_missing], k[:n_missing])
+                    )
+                    if max_violations is not None and result["n_violations"] >= max_violations:
+                        result["complete"] = False
+                        stop.set()
+                        return
+
+    with ThreadPoolExecutor(n_threads) as executor:
+        # Raise exceptions from threads
+        list(executor.map(_check_row_block, blocks))
+
+    return result
+
+
+class DistanceMatrixReport:
+    """
+    Diagnostics for a distance matrix (see `distance_matrix_report`).
+
+    Attributes
+    ----------
+    n : int
+        Number of rows (and columns).
+    n_missing : int
+        Number of missing distances (NaN).
+    min_distance : float
+        Smallest distance.
+    max_asymmetry : float
+        Largest |matrix[i, j] - matrix[j, i]|; infinite if only one of both is missing.
+    max_diagonal : float
+        Largest |matrix[i, i]|.
+    tolerance : float
+        Accepted tolerance for the triangular inequality.
+    confidence : float
+        Confidence level of the violation rate bounds.
+    n_triplets : int
+        Number of sampled triplets (i, j, k) without missing distances.
+    n_violations : int
+        Number of sampled triplets that violate the triangular inequality.
+    violation_rate : float
+        Estimated fraction of triplets that violate the triangular inequality.
+    violation_rate_bounds : tuple of float
+        Lower and upper confidence bound of the violation rate.
+    worst_violation : float or None
+        Largest matrix[i, j] - matrix[i, k] - matrix[k, j] of all violating sampled triplets.
+    worst_triplet : tuple of int or None
+        (i, j, k) for the worst violation.
+    strata : pd.DataFrame or None
+        Number of rows, sampled triplets, violations, and violation rate with confidence bounds
+        (columns) per stratum (rows) for stratified sampling.
+    """
+
+    def __init__(self, **attributes):
+        self.n = None
+        self.n_missing = None
+        self.min_distance = None
+        self.max_asymmetry = None
+        self.max_diagonal = None
+        self.tolerance = None
+        self.confidence = None
+        self.n_triplets = None
+        self.n_violations = None
+        self.violation_rate = None
+        self.violation_rate_bounds = None
+        self.worst_violation = None
+        self.worst_triplet = None
+        self.strata = None
+        for name, value in attributes.items():
+            if not hasattr(self, name):
+                raise KeyError(f"Unknown report attribute: {name}")
+            setattr(self, name, value)
+
+    @property
+    def positive(self):
+        """
+        True if all (non-missing) distances are positive.
+        """
+        return self.min_distance >= 0
+
+    @property
+    def null_diagonal(self):
+        """
+        True if all diagonal entries are zero.
+        """
+        return self.max_diagonal == 0
+
+    @property
+    def symmetric(self):
+        """
+        True if the matrix is symmetric.
+        """
+        return self.max_asymmetry == 0
+
+    def to_dict(self):
+        """
+        Get report as dictionary.
+
+        Returns
+        -------
+        dict
+            Report attributes and checks (keys) and their values (values).
+        """
+        report = dict(vars(self))
+        report.update(
+            positive=self.positive, null_diagonal=self.null_diagonal, symmetric=self.symmetric
+        )
+        return report
+
+    def __str__(self):
+        low, high = self.violation_rate_bounds
+        return "\n".join(
+            [
+                f"{'Matrix size:' : <30}{self.n} x {self.n}",
+                f"{'Missing values:' : <30}{self.n_missing}",
+                f"{'Matrix positive?:' : <30}{self.positive}",
+                f"{'Matrix diagonale 0?:' : <30}{self.null_diagonal}",
+                f"{'Matrix symmetric?:' : <30}{self.symmetric}",
+                f"{'Triangular violations:' : <30}{self.violation_rate:.2e} "
+                f"[{low:.2e}, {high:.2e}] ({self.confidence:.0%} confidence, "
+                f"{self.n_violations}/{self.n_triplets} sampled triplets)",
+            ]
+        )
+
+
+def distance_matrix_report(
+    matrix,
+    tolerance=0.11,
+    n_triplets=100000,
+    strata=None,
+    confidence=0.95,
+    block_size=2048,
+    seed=None,
+):
+    """
+    Check a distance matrix that may not fit into memory.
+
+    Positivity, missing values, the diagonal, and symmetry are checked exactly by streaming the
+    matrix in tiles of `block_size` x `block_size` (each tile together with its mirrored tile).
+    The triangular inequality is not checked exhaustively (cubic runtime), but the fraction of
+    violating triplets is estimated from randomly sampled triplets (i, j, k), with Wilson score
+    confidence bounds; for stratified sampling, the same number of triplets is sampled per
+    stratum of rows i and the overall rate is weighted by the stratum sizes.
+
+    Parameters
+    ----------
+    matrix : np.array or pd.DataFrame or str or pathlib.Path
+        Square distance matrix or path to a NPY file with a square distance matrix (memory-mapped).
+    tolerance : float
+        The accepted tolerance for the triangular inequality.
+    n_triplets : int
+        Number of sampled triplets.
+    strata : array-like or None
+        Stratum label for each row, e.g. the kinase of each structure. If None, sample triplets
+        uniformly.
+    confidence : float
+        Confidence level of the violation rate bounds.
+    block_size : int
+        Tile edge length for streaming checks.
+    seed : int or None
+        Random seed for triplet sampling.
+
+    Returns
+    -------
+    src.utils.DistanceMatrixReport
+        Diagnostics report.
+    """
+    if isinstance(matrix, (str, Path)):
+        matrix = np.load(matrix, mmap_mode="r")
+    elif not isinstance(matrix, np.ndarray):
+        matrix = np.asarray(matrix, dtype=np.float64)
+    _check_dimensionality(matrix)
+    n = matrix.shape[0]
+
+    # Streaming checks on upper tiles and their mirrored lower tiles
+    n_missing = 0
+    min_distance = np.inf
+    max_asymmetry = 0.0
+    max_diagonal = 0.0
+    for start_row in range(0, n, block_size):
+        rows = slice(start_row, min(start_row + block_size, n))
+        for start_column in range(start_row, n, block_size):
+            columns = slice(start_column, min(start_column + block_size, n))
+            tile = np.asarray(matrix[rows, columns], dtype=np.float64)
+            tiles = [tile]
+            if start_column == start_row:
+                max_diagonal = max(max_diagonal, np.nanmax(np.abs(np.diagonal(tile))))
+                mirrored_tile = tile.T
+            else:
+                mirrored_tile = np.asarray(matrix[columns, rows], dtype=np.float64).T
+                tiles.append(mirrored_tile)
+            for tile_ in tiles:
+                missing = np.isnan(tile_)
+                n_missing += int(missing.sum())
+                if not missing.all():
+                    min_distance = min(min_distance, np.nanmin(tile_))
+            if (np.isnan(tile) != np.isnan(mirrored_tile)).any():
+                max_asymmetry = np.inf
+            elif not np.isnan(tile).all():
+                max_asymmetry = max(max_asymmetry, np.nanmax(np.abs(tile - mirrored_tile)))
+
+    # Sampled triangular inequality checks
+    rng = np.random.default_rng(seed)
+    z = norm.ppf(0.5 + confidence / 2)
+    if strata is None:
+        stratum_rows = {"all": np.arange(n)}
+    else:
+        strata = pd.Series(np.asarray(strata))
+        if len(strata) != n:
+            raise ValueError("Number of stratum labels must match the matrix size.")
+        stratum_rows = {
+            label: rows.to_numpy() for label, rows in strata.groupby(strata).groups.items()
+        }
+    n_triplets_per_stratum = -(-n_triplets // len(stratum_rows))
+
+    strata_stats = []
+    worst_violation, worst_triplet = None, None
+    for label, rows in stratum_rows.items():
+        i = rng.choice(rows, n_triplets_per_stratum)
+        j, k = rng.integers(0, n, (2, n_triplets_per_stratum))
+        # Sort by i for local reads from memory-mapped matrices
+        order = np.argsort(i, kind="stable")
+        i, j, k = i[order], j[order], k[order]
+        excess = np.asarray(matrix[i, j], dtype=np.float64)
+        excess -= matrix[i, k]
+        excess -= matrix[k, j]
+        valid = ~np.isnan(excess)
+        violations = excess > tolerance
+        if violations.any():
+            worst = np.argmax(np.where(violations, excess, -np.inf))
+            if worst_violation is None or excess[worst] > worst_violation:
+                worst_violation = float(excess[worst])
+                worst_triplet = (int(i[worst]), int(j[worst]), int(k[worst]))
+        n_valid, n_violations = int(valid.sum()), int(violations.sum())
+        rate, low, high = _wilson_interval(n_violations, n_valid, z)
+        strata_stats.append([label, len(rows), n_valid, n_violations, rate, low, high])
+    strata_stats = pd.DataFrame(
+        strata_stats,
+        columns=["stratum", "n_rows", "n_triplets", "n_violations", "rate", "low", "high"],
+    ).set_index("stratum")
+
+    # Overall rate (weighted by stratum size) with normal approximation for stratified sampling
+    if strata is None:
+        violation_rate, low, high = strata_stats.iloc[0][["rate", "low", "high"]]
+        violation_rate_bounds = (low, high)
+    else:
+        weights = strata_stats["n_rows"] / n
+        rates = strata_stats["n_violations"] / strata_stats["n_triplets"].clip(lower=1)
+        violation_rate = float((weights * rates).sum())
+        standard_error = np.sqrt(
+            (weights**2 * rates * (1 - rates) / strata_stats["n_triplets"].clip(lower=1)).sum()
+        )
+        violation_rate_bounds = (
+            max(0.0, violation_rate - z * standard_error),
+            min(1.0, violation_rate + z * standard_error),
+        )
+
+    return DistanceMatrixReport(
+        n=n,
+        n_missing=n_missing,
+        min_distance=float(min_distance),
+        max_asymmetry=float(max_asymmetry),
+        max_diagonal=float(max_diagonal),
+        tolerance=tolerance,
+        confidence=confidence,
+        n_triplets=int(strata_stats["n_triplets"].sum()),
+        n_violations=int(strata_stats["n_violations"].sum()),
+        violation_rate=float(violation_rate),
+        violation_rate_bounds=tuple(float(bound) for bound in violation_rate_bounds),
+        worst_violation=worst_violation,
+        worst_triplet=worst_triplet,
+        strata=None if strata is None else strata_stats,
+    )
+
+
+def _wilson_interval(n_successes, n_trials, z):
+    """
+    Get rate and Wilson score confidence interval for a binomial proportion.
+    """
+    if n_trials == 0:
+        return np.nan, 0.0, 1.0
+    rate = n_successes / n_trials
+    denominator = 1 + z**2 / n_trials
+    center = (rate + z**2 / (2 * n_trials)) / denominator
+    half_width = z * np.sqrt(rate * (1 - rate) / n_trials + z**2 / (4 * n_trials**2)) / denominator
+    return rate, max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def atomic_write(path, write_function):
+    """
+    Write a file via a temporary file next to it that replaces the file only when complete, so
+    that readers (also in other processes) never see incomplete files.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to file (parent folders are created if needed).
+    write_function : callable
+        Function that writes the file content to the path given as its only argument.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path_tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        write_function(path_tmp)
+        os.replace(path_tmp, path)
+    finally:
+        if path_tmp.exists():
+            path_tmp.unlink()
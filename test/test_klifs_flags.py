@@ -0,0 +1,118 @@
+"""
+Unit tests for src.data.klifs_flags, run against a local stub of the KLIFS REST API.
+"""
+
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.data.klifs_flags import FlagService
+
+# Structure KLIFS IDs known to the stub; every third structure is flagged
+KNOWN_IDS = range(1, 1000)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    Serve `/structure_list?structure_ID=1,2,...` and record the requested IDs per request.
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/structure_list":
+            self.send_error(404)
+            return
+        structure_klifs_ids = [
+            int(i) for i in urllib.parse.parse_qs(url.query)["structure_ID"][0].split(",")
+        ]
+        self.server.requests.append(structure_klifs_ids)
+        structures = [
+            {"structure_ID": i, "curation_flag": int(i % 3 == 0)}
+            for i in structure_klifs_ids
+            if i in KNOWN_IDS
+        ]
+        body = json.dumps(structures).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _flag_service(server, cache_path, **kwargs):
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    return FlagService(api_url=api_url, cache_path=cache_path, **kwargs)
+
+
+@pytest.mark.parametrize("chunk_size, n_requests", [(3, 4), (10, 1), (500, 1)])
+def test_flags_chunks(server, tmp_path, chunk_size, n_requests):
+    """
+    Test that uncached structures are requested in chunks and unknown structures map to None.
+    """
+
+    flag_service = _flag_service(server, tmp_path, release="r1", chunk_size=chunk_size)
+    structure_klifs_ids = [9, 1, 2, 3, 4, 5, 6, 7, 8, 5000]
+    flags = flag_service.flags(structure_klifs_ids)
+
+    assert flags == {i: (i % 3 == 0 if i in KNOWN_IDS else None) for i in structure_klifs_ids}
+    assert len(server.requests) == n_requests
+    assert all(len(chunk) <= chunk_size for chunk in server.requests)
+    requested_ids = [i for chunk in server.requests for i in chunk]
+    assert sorted(requested_ids) == sorted(structure_klifs_ids)
+
+
+def test_flags_cache_per_release(server, tmp_path):
+    """
+    Test that cached flags are reused across services of the same release only.
+    """
+
+    _flag_service(server, tmp_path, release="r1").flags([1, 2, 3])
+    assert (tmp_path / "r1.json").exists()
+    assert server.requests == [[1, 2, 3]]
+
+    # Same release: Only new structures are requested
+    flag_service = _flag_service(server, tmp_path, release="r1")
+    assert flag_service.flagged([1, 2, 3, 4, 6]) == {3, 6}
+    assert server.requests == [[1, 2, 3], [4, 6]]
+    assert flag_service.flags([1, 2, 3, 4, 6]) == {1: False, 2: False, 3: True, 4: False, 6: True}
+    assert len(server.requests) == 2
+
+    # Other release: All structures are requested
+    _flag_service(server, tmp_path, release="r2").flags([1, 2])
+    assert server.requests[-1] == [1, 2]
+
+    flag_service.clear()
+    assert not (tmp_path / "r1.json").exists()
+    assert (tmp_path / "r2.json").exists()
+
+
+def test_flags_offline(server, tmp_path):
+    """
+    Test that offline services use cached flags only and never connect to KLIFS.
+    """
+
+    _flag_service(server, tmp_path, release="r1").flags([1, 2, 3, 5000])
+    n_requests = len(server.requests)
+
+    flag_service = _flag_service(server, tmp_path, release="r1", offline=True)
+    assert flag_service.flags([3, 5000]) == {3: True, 5000: None}
+    with pytest.raises(FileNotFoundError):
+        flag_service.flags([1, 4])
+    assert len(server.requests) == n_requests